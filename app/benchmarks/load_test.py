@@ -0,0 +1,253 @@
+"""Load test and latency benchmark for the API.
+
+Run it from the app directory:
+
+    python -m benchmarks.load_test --users 20 --tasks 50 --requests 2000 --concurrency 32
+    python -m benchmarks.load_test --uvicorn --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/baseline.json --tolerance 0.2
+
+By default the ASGI app is driven in-process through httpx; --uvicorn spawns a local
+uvicorn server instead, and --url targets an already running one. Both self-hosted
+modes use a fresh SQLite database in a temporary directory. With --baseline the run
+exits with status 1 when it is slower than the baseline by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+API_KEY = "123456"
+PASSWORD = "Bench@123"
+
+# relative weight of each operation in the mixed workload
+WORKLOAD = {
+    "POST /signup": 1,
+    "POST /token": 2,
+    "POST /tasks": 15,
+    "GET /tasks": 40,
+    "GET /tasks/{task_id}": 25,
+    "PUT /tasks/{task_id}": 10,
+    "DELETE /tasks/{task_id}": 7,
+}
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+def summarize(latencies: dict[str, list[float]], errors: dict[str, int], elapsed: float) -> dict:
+    """Builds the report: requests per second and p50/p95/p99 in milliseconds per endpoint."""
+    endpoints = {}
+    for name, values in sorted(latencies.items()):
+        values = sorted(values)
+        endpoints[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "rps": round(len(values) / elapsed, 2),
+            "p50": round(percentile(values, 0.50) * 1000, 3),
+            "p95": round(percentile(values, 0.95) * 1000, 3),
+            "p99": round(percentile(values, 0.99) * 1000, 3),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {"elapsed": round(elapsed, 3), "total_rps": round(total / elapsed, 2), "endpoints": endpoints}
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns one message per metric that regressed by more than tolerance (0.2 = 20%)."""
+    regressions = []
+    if report["total_rps"] < baseline["total_rps"] * (1 - tolerance):
+        regressions.append(f"total: {report['total_rps']} req/s < baseline {baseline['total_rps']} req/s")
+    for name, expected in baseline["endpoints"].items():
+        actual = report["endpoints"].get(name)
+        if actual is None:
+            continue
+        for metric in ("p50", "p95", "p99"):
+            if actual[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {actual[metric]} ms > baseline {expected[metric]} ms")
+    return regressions
+
+def auth_headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}", "X-API-Key": API_KEY}
+
+async def seed(client: httpx.AsyncClient, users: int, tasks: int, prefix: str) -> list[dict]:
+    """Creates the users with their tasks and returns their tokens and task ids."""
+    accounts = []
+    for index in range(users):
+        username = f"{prefix}{index}"
+        response = await client.post("/signup", json={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        response = await client.post("/token", json={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        account = {"username": username, "token": response.json()["access_token"], "task_ids": []}
+        for start in range(0, tasks, 500):
+            batch = [{"title": f"task {number}", "description": "seeded"} for number in range(start, min(tasks, start + 500))]
+            response = await client.post("/tasks/batch", json=batch, headers=auth_headers(account["token"]))
+            response.raise_for_status()
+            account["task_ids"].extend(result["id"] for result in response.json())
+        accounts.append(account)
+    return accounts
+
+async def run_operation(client: httpx.AsyncClient, name: str, accounts: list[dict], rng: random.Random, prefix: str, counter: list[int]):
+    account = rng.choice(accounts)
+    headers = auth_headers(account["token"])
+    if name == "POST /signup":
+        counter[0] += 1
+        return await client.post("/signup", json={"username": f"{prefix}new{counter[0]}", "password": PASSWORD})
+    if name == "POST /token":
+        return await client.post("/token", json={"username": account["username"], "password": PASSWORD})
+    if name == "POST /tasks":
+        response = await client.post("/tasks", json={"title": "bench", "description": "bench"}, headers=headers)
+        if response.status_code == 200:
+            account["task_ids"].append(response.json()["id"])
+        return response
+    if name == "GET /tasks":
+        return await client.get("/tasks", headers=headers)
+    if not account["task_ids"]:
+        return await client.get("/tasks", headers=headers)
+    task_id = rng.choice(account["task_ids"])
+    if name == "GET /tasks/{task_id}":
+        return await client.get(f"/tasks/{task_id}", headers=headers)
+    if name == "PUT /tasks/{task_id}":
+        # completed tasks answer 400, which is an expected outcome of the mix
+        return await client.put(f"/tasks/{task_id}", json={"title": "bench", "description": "done"}, headers=headers)
+    account["task_ids"].remove(task_id)
+    return await client.delete(f"/tasks/{task_id}", headers=headers)
+
+async def run_workload(client: httpx.AsyncClient, accounts: list[dict], requests: int, concurrency: int, seed_value: int, prefix: str) -> dict:
+    rng = random.Random(seed_value)
+    names = rng.choices(list(WORKLOAD), weights=list(WORKLOAD.values()), k=requests)
+    latencies = {name: [] for name in WORKLOAD}
+    errors = {}
+    counter = [0]
+    queue = iter(names)
+
+    async def worker():
+        for name in queue:
+            started = time.perf_counter()
+            response = await run_operation(client, name, accounts, rng, prefix, counter)
+            latencies[name].append(time.perf_counter() - started)
+            if response.status_code >= 500 or (response.status_code >= 400 and name != "PUT /tasks/{task_id}"):
+                errors[name] = errors.get(name, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return summarize({name: values for name, values in latencies.items() if values}, errors, elapsed)
+
+@asynccontextmanager
+async def in_process_client(app=None):
+    """Drives the ASGI app through httpx without a network, running its lifespan."""
+    if app is None:
+        from main import app
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60) as client:
+            yield client
+
+@asynccontextmanager
+async def uvicorn_client(env: dict):
+    """Spawns uvicorn on a free local port and yields a client pointed at it."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            yield client
+    finally:
+        process.terminate()
+        process.wait()
+
+@asynccontextmanager
+async def url_client(url: str):
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        yield client
+
+async def benchmark(client: httpx.AsyncClient, users: int, tasks: int, requests: int, concurrency: int, seed_value: int = 0) -> dict:
+    """Seeds the database through the API, then runs the mixed workload and returns the report."""
+    prefix = f"bench{int(time.time() * 1000)}u"
+    accounts = await seed(client, users, tasks, prefix)
+    return await run_workload(client, accounts, requests, concurrency, seed_value, prefix)
+
+def print_report(report: dict):
+    print(f"{'endpoint':<26}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:<26}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>10}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+    print(f"total: {report['total_rps']} req/s in {report['elapsed']} s")
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test and latency benchmark for the API")
+    parser.add_argument("--users", type=int, default=10, help="users seeded before the run")
+    parser.add_argument("--tasks", type=int, default=100, help="tasks seeded per user")
+    parser.add_argument("--requests", type=int, default=1000, help="requests in the mixed workload")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the workload")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--uvicorn", action="store_true", help="spawn a local uvicorn server instead of running in-process")
+    target.add_argument("--url", help="benchmark an already running server")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline, 0.2 = 20%%")
+    parser.add_argument("--save-baseline", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ)
+        env.setdefault("SECRET_KEY", "benchmark-secret")
+        env.setdefault("ALGORITHM", "HS256")
+        env.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+        # every simulated user comes from one IP and runs flat out, measure the API rather than the limits
+        env.setdefault("RATE_LIMIT_USER_RATE", "0")
+        env.setdefault("RATE_LIMIT_IP_RATE", "0")
+        env.setdefault("ADMISSION_MAX_IN_FLIGHT", "0")
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        env.pop("DATABASE_READ_URL", None)
+        if args.url:
+            client = url_client(args.url)
+        elif args.uvicorn:
+            client = uvicorn_client(env)
+        else:
+            # settings are read when main is imported, so set them first
+            os.environ.update(env)
+            client = in_process_client()
+
+        async def run():
+            async with client as http_client:
+                return await benchmark(http_client, args.users, args.tasks, args.requests, args.concurrency, args.seed)
+
+        report = asyncio.run(run())
+
+    print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
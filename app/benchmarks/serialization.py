@@ -0,0 +1,84 @@
+"""Per-row serialization cost of a task list.
+
+Run it from the app directory:
+
+    python -m benchmarks.serialization --rows 10000
+
+Compares the old GET /tasks path (a TaskResponse per ORM row, then FastAPI validating and
+serializing the list again through the response model) with building the payload straight
+from row tuples, encoded by the standard json module or by orjson.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from db import Task, TaskStatus
+from schemas import TaskResponse
+from utils.json_utils import task_rows_to_dicts
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+Row = namedtuple("Row", ["id", "title", "description", "status"])
+
+def make_rows(count: int) -> list[Row]:
+    statuses = (TaskStatus.pending, TaskStatus.completed)
+    return [Row(index, f"task {index}", f"description of task {index}", statuses[index % 2]) for index in range(count)]
+
+def make_orm_tasks(rows: list[Row]) -> list[Task]:
+    return [Task(id=row.id, user_id=1, title=row.title, description=row.description, status=row.status, created_at=datetime.now()) for row in rows]
+
+async def response_model_path(tasks: list[Task], field) -> bytes:
+    """What GET /tasks used to do: TaskResponse per row, then the response model validates and serializes again."""
+    content = [TaskResponse(id=task.id, title=task.title, description=task.description, status=task.status.value) for task in tasks]
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+def json_path(rows: list[Row]) -> bytes:
+    return json.dumps(task_rows_to_dicts(rows), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def orjson_path(rows: list[Row]) -> bytes:
+    return orjson.dumps(task_rows_to_dicts(rows))
+
+def measure(function, repeat: int) -> float:
+    """Best wall time of repeat runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Per-row serialization cost of a task list")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rows = make_rows(args.rows)
+    tasks = make_orm_tasks(rows)
+    field = create_model_field(name="Response_get_tasks", type_=list[TaskResponse], mode="serialization")
+    loop = asyncio.new_event_loop()
+    results = {
+        "response model (before)": measure(lambda: loop.run_until_complete(response_model_path(tasks, field)), args.repeat),
+        "row tuples + json": measure(lambda: json_path(rows), args.repeat),
+    }
+    if orjson is not None:
+        results["row tuples + orjson (FAST_JSON=1)"] = measure(lambda: orjson_path(rows), args.repeat)
+    loop.close()
+
+    print(f"{'path':<36}{'total ms':>10}{'us/row':>10}")
+    for name, seconds in results.items():
+        print(f"{name:<36}{seconds * 1000:>10.2f}{seconds * 1e6 / args.rows:>10.3f}")
+    return results
+
+if __name__ == "__main__":
+    main()
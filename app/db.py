@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url, inspect, text, select, delete, insert, func, case, literal, union_all
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
+from sqlalchemy.schema import CreateTable, CreateIndex
+from starlette.concurrency import run_in_threadpool
+from utils.metrics_utils import instrument_engine, TimedQueuePool, TimedAsyncAdaptedQueuePool
 import enum
+import os
 from sqlalchemy import Enum
 from datetime import datetime
 
@@ -10,13 +16,131 @@ class TaskStatus(enum.Enum):
     pending = "pending"
     completed = "completed"
 
-engine = create_engine(
-    "sqlite:///app.db", connect_args={"check_same_thread": False}
-)
+# Set DB_CREATE_SCHEMA=0 on read-only replicas, where startup must not write
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "1") != "0"
+# Set USE_ASYNC_DB=0 to fall back to the sync engine (queries then run in the threadpool)
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "1") != "0"
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
+# GET endpoints use a separate pool, point it to a replica or leave it on the primary database
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", DATABASE_URL)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(DB_POOL_SIZE)))
+
+# Applied to every new SQLite connection, in this order
+SQLITE_PRAGMAS = {
+    # must come before journal_mode, which initializes a new database file; takes effect
+    # on new databases and on older ones after `manage.py vacuum`
+    "auto_vacuum": os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT", "5000"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-64000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "mysql": "mysql+aiomysql"}
+
+def set_sqlite_pragmas(dbapi_connection, connection_record, read_only: bool = False):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def create_db_engine(url: str, is_async: bool = False, read_only: bool = False):
+    """Creates the instrumented engine for url with the pool settings, and the SQLite pragmas when it is a SQLite database."""
+    url = make_url(url)
+    if is_async and "+" not in url.drivername:
+        url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+    options = {"pool_logging_name": "read" if read_only else "primary"}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+    if url.database not in (None, "", ":memory:"):
+        options.update(
+            pool_size=DB_READ_POOL_SIZE if read_only else DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        )
+    new_engine = create_async_engine(url, **options) if is_async else create_engine(url, **options)
+    sync_engine = new_engine.sync_engine if is_async else new_engine
+    instrument_engine(sync_engine)
+    if url.get_backend_name() == "sqlite":
+        event.listen(sync_engine, "connect", lambda dbapi_connection, connection_record: set_sqlite_pragmas(dbapi_connection, connection_record, read_only))
+    return new_engine
+
+engine = create_db_engine(DATABASE_URL)
+async_engine = create_db_engine(DATABASE_URL, is_async=True)
+read_engine = create_db_engine(DATABASE_READ_URL, read_only=True)
+async_read_engine = create_db_engine(DATABASE_READ_URL, is_async=True, read_only=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+class _ThreadpoolResult:
+    """Async view over a sync Result, each partition is fetched in the threadpool."""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size: int | None = None):
+        partitions = self.result.partitions(size)
+        while (rows := await run_in_threadpool(next, partitions, None)) is not None:
+            yield rows
+
+class SyncSessionAdapter:
+    """Wraps a sync Session behind the AsyncSession methods used by the handlers."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self.session.execute, *args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        return _ThreadpoolResult(await run_in_threadpool(self.session.execute, *args, **kwargs))
+
+    async def commit(self):
+        await run_in_threadpool(self.session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.session.rollback)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.session.delete, instance)
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    async def close(self):
+        await run_in_threadpool(self.session.close)
+
+async def get_session(read_only: bool = False):
+    """Yields an AsyncSession, or a SyncSessionAdapter when USE_ASYNC_DB is off.
+
+    read_only sessions come from the read pool, where SQLite connections reject writes.
+    """
+    if USE_ASYNC_DB:
+        async with (AsyncReadSessionLocal if read_only else AsyncSessionLocal)() as session:
+            yield session
+    else:
+        session = SyncSessionAdapter((ReadSessionLocal if read_only else SessionLocal)(expire_on_commit=False))
+        try:
+            yield session
+        finally:
+            await session.close()
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -32,4 +156,182 @@ class Task(Base):
     status = Column(Enum(TaskStatus), default=TaskStatus.pending)
     created_at = Column(DateTime, default=datetime.now)
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    __table_args__ = (
+        # keyset pages of GET /tasks, with and without a status filter
+        Index("ix_tasks_user_id_status_id", "user_id", "status", "id"),
+        Index("ix_tasks_user_id_id", "user_id", "id"),
+        # completed tasks due for archival
+        Index("ix_tasks_status_created_at", "status", "created_at"),
+        # SQLite would otherwise hand out the id of the last task again once it is archived
+        {"sqlite_autoincrement": True},
+    )
+
+class TaskArchive(Base):
+    """Completed tasks moved out of tasks by the archiver, keeping their ids (never reused by tasks), so the hot table stays small."""
+    __tablename__ = 'tasks_archive'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    title = Column(String(100))
+    description = Column(String(255))
+    status = Column(Enum(TaskStatus), default=TaskStatus.completed)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # keyset pages of GET /tasks/archive
+        Index("ix_tasks_archive_user_id_id", "user_id", "id"),
+    )
+
+class TaskVersion(Base):
+    """Per-user counter bumped by every task write, the source of the task ETags."""
+    __tablename__ = 'task_versions'
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class TaskStats(Base):
+    """Per-user task counts by status, kept up to date by every task write."""
+    __tablename__ = 'task_stats'
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    pending = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+
+def count_tasks_by_user():
+    """SELECT user_id, pending, completed computed from the tasks table; archived tasks count as completed."""
+    rows = union_all(
+        select(
+            Task.user_id,
+            case((Task.status == TaskStatus.pending, 1), else_=0).label("pending"),
+            case((Task.status == TaskStatus.completed, 1), else_=0).label("completed"),
+        ),
+        select(TaskArchive.user_id, literal(0).label("pending"), literal(1).label("completed")),
+    ).subquery()
+    return select(
+        rows.c.user_id,
+        func.sum(rows.c.pending).label("pending"),
+        func.sum(rows.c.completed).label("completed"),
+    ).group_by(rows.c.user_id)
+
+def rebuild_task_stats(connection):
+    """Recomputes every user's counters from the tasks table."""
+    connection.execute(delete(TaskStats))
+    connection.execute(insert(TaskStats).from_select(["user_id", "pending", "completed"], count_tasks_by_user()))
+
+def check_task_stats(connection) -> list[dict]:
+    """Returns the users whose counters differ from the tasks table, with both values."""
+    expected = {row.user_id: (row.pending, row.completed) for row in connection.execute(count_tasks_by_user())}
+    actual = {row.user_id: (row.pending, row.completed) for row in connection.execute(select(TaskStats.user_id, TaskStats.pending, TaskStats.completed))}
+    mismatches = []
+    for user_id in sorted(expected.keys() | actual.keys()):
+        if expected.get(user_id, (0, 0)) != actual.get(user_id, (0, 0)):
+            mismatches.append({"user_id": user_id, "expected": expected.get(user_id, (0, 0)), "actual": actual.get(user_id, (0, 0))})
+    return mismatches
+
+# Full-text index over task titles and descriptions (SQLite FTS5). It is an external content
+# table: it stores only the index and reads the text from tasks, the triggers keep it in sync
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(title, description, content='tasks', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, description ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+def search_supported(bind) -> bool:
+    return bind.dialect.name == "sqlite"
+
+def rebuild_search_index(connection):
+    """Re-indexes every task, for databases whose tasks predate the index or after a manual edit."""
+    connection.execute(text("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"))
+
+def incremental_vacuum(connection, pages: int) -> int:
+    """Returns up to pages free pages of the SQLite file to the OS, and how many were returned.
+
+    Only databases in auto_vacuum=INCREMENTAL mode support it, `manage.py vacuum`
+    converts older ones. Run it outside a transaction.
+    """
+    if connection.dialect.name != "sqlite" or connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        return 0
+    before = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    connection.rollback()
+    # the statement frees one page per step, executescript steps it to completion
+    connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return before - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+def vacuum(connection):
+    """Rebuilds the SQLite file compactly, applying SQLITE_AUTO_VACUUM; blocks every writer while it runs."""
+    connection.rollback()
+    connection.connection.driver_connection.executescript(f"PRAGMA auto_vacuum={SQLITE_PRAGMAS['auto_vacuum']}; VACUUM")
+
+def migrate_tasks_autoincrement(connection) -> bool:
+    """Rebuilds a SQLite tasks table created without AUTOINCREMENT, returns whether it did.
+
+    The rows keep their ids and the sequence starts after the highest id of tasks and
+    tasks_archive. Archived tasks whose id was already handed out again get a new one.
+    Runs in one transaction, outside of any other.
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+    sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tasks'").scalar()
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return False
+    columns = ", ".join(column.name for column in Task.__table__.columns)
+    statements = [
+        "BEGIN IMMEDIATE",
+        # the indexes and search triggers follow the renamed table and go away with it
+        "ALTER TABLE tasks RENAME TO tasks_old",
+        *(f"DROP INDEX IF EXISTS {index.name}" for index in Task.__table__.indexes),
+        str(CreateTable(Task.__table__).compile(connection)),
+        *(str(CreateIndex(index).compile(connection)) for index in Task.__table__.indexes),
+        f"INSERT INTO tasks ({columns}) SELECT {columns} FROM tasks_old",
+        "DROP TABLE tasks_old",
+        "UPDATE tasks_archive SET id = id + (SELECT coalesce(max(id), 0) FROM tasks) + (SELECT coalesce(max(id), 0) FROM tasks_archive) WHERE id IN (SELECT id FROM tasks)",
+        # an empty table has no sequence row yet
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'tasks', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'tasks')",
+        "UPDATE sqlite_sequence SET seq = max(seq, (SELECT coalesce(max(id), 0) FROM tasks_archive)) WHERE name = 'tasks'",
+        "COMMIT",
+    ]
+    connection.rollback()
+    connection.connection.driver_connection.executescript(";\n".join(statements))
+    return True
+
+def init_db():
+    """Creates the missing tables and indexes, called on startup unless DB_CREATE_SCHEMA=0."""
+    stats_exist = inspect(engine).has_table("task_stats")
+    Base.metadata.create_all(bind=engine)
+    if not stats_exist:
+        # the counters start from the tasks already in the database
+        with engine.begin() as connection:
+            rebuild_task_stats(connection)
+    with engine.connect() as connection:
+        migrate_tasks_autoincrement(connection)
+    # create_all skips indexes of tables that already exist
+    for index in Task.__table__.indexes | TaskArchive.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    if search_supported(engine):
+        with engine.begin() as connection:
+            exists = inspect(connection).has_table("tasks_fts")
+            for statement in SEARCH_DDL:
+                connection.execute(text(statement))
+            if not exists:
+                rebuild_search_index(connection)
+
+async def warm_pools():
+    """Opens a connection for every pool slot, so the first requests do not pay for connecting."""
+    if USE_ASYNC_DB:
+        for pool_engine in (async_engine, async_read_engine):
+            size = pool_engine.pool.size() if isinstance(pool_engine.pool, QueuePool) else 1
+            connections = [await pool_engine.connect() for _ in range(size)]
+            for connection in connections:
+                await connection.close()
+    else:
+        for pool_engine in (engine, read_engine):
+            size = pool_engine.pool.size() if isinstance(pool_engine.pool, QueuePool) else 1
+            connections = [await run_in_threadpool(pool_engine.connect) for _ in range(size)]
+            for connection in connections:
+                await run_in_threadpool(connection.close)
\ No newline at end of file
@@ -1,157 +1,589 @@
-from fastapi import FastAPI, Depends, Request
-from utils.auth_utils import validate_password, validate_username, get_password_hash, verify_password, create_access_token, validate_token, validate_request
-from fastapi.responses import JSONResponse
-from db import engine, SessionLocal, Base, User, Task, TaskStatus
-from sqlalchemy.orm import Session
-from schemas import UserRequest, Token, TaskRequest, TaskResponse
-from sqlalchemy import select, insert
+import dotenv
+# settings are read from the environment when the modules below are imported
+dotenv.load_dotenv()
+
+from fastapi import FastAPI, Depends, Request, Response, Query, Body, Header, WebSocket
+from utils.auth_utils import validate_password, validate_username, create_access_token, validate_token, validate_request, validate_admin
+from utils.hash_utils import hash_password, check_password, get_pwd_context, shutdown_executor, HashPoolFull
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, FileResponse
+from db import read_engine, async_engine, async_read_engine, get_session, init_db, search_supported, warm_pools, DB_CREATE_SCHEMA, User, Task, TaskArchive, TaskStatus
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import UserRequest, Token, TaskRequest, TaskResponse, ArchivedTaskResponse, TaskUpdateItem, BatchItemResult
+from sqlalchemy import select, insert, update, delete, case
 from datetime import datetime
-from utils.task_utils import validate_task
-import json
+from utils.task_utils import get_user_task, complete_task, remove_task, task_update_error
+from utils.metrics_utils import MetricsMiddleware, render_metrics
+from utils.rate_limit_utils import AdmissionMiddleware, server_busy
+from utils.profile_utils import ProfilerMiddleware, list_profiles, profile_path, profile_text
+from utils.slow_query_utils import slow_queries
+from utils.etag_utils import get_tasks_version, bump_tasks_version, make_etag, etag_matches, not_modified, get_cached_page, cache_page
+from utils.search_utils import search_tasks
+from utils.stats_utils import update_task_stats, get_task_stats
+from utils.group_commit_utils import TaskWriteQueue, GROUP_COMMIT
+from utils.events_utils import broker
+from utils.archive_utils import run_archiver, ARCHIVE_INTERVAL
+from utils.json_utils import ResponseClass, dumps, json_response, task_rows_to_dicts
+import asyncio
+import csv
+import io
+import os
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", "100"))
+TASKS_MAX_PAGE_SIZE = int(os.getenv("TASKS_MAX_PAGE_SIZE", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+TASKS_MAX_BATCH_SIZE = int(os.getenv("TASKS_MAX_BATCH_SIZE", "500"))
+
+task_write_queue = TaskWriteQueue() if GROUP_COMMIT else None
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_CREATE_SCHEMA:
+        await run_in_threadpool(init_db)
+    await warm_pools()
+    await run_in_threadpool(get_pwd_context)
+    if task_write_queue is not None:
+        task_write_queue.start()
+    archiver = asyncio.create_task(run_archiver(ARCHIVE_INTERVAL)) if ARCHIVE_INTERVAL > 0 else None
+    yield
+    if archiver is not None:
+        archiver.cancel()
+    if task_write_queue is not None:
+        await task_write_queue.stop()
+    shutdown_executor()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
-def get_db():
-    db = SessionLocal()
-    try:
+app = FastAPI(lifespan=lifespan, default_response_class=ResponseClass)
+# the last middleware added runs first, so shed requests are still measured and never profiled
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+async def get_db():
+    async for db in get_session():
+        yield db
+
+async def get_read_db():
+    async for db in get_session(read_only=True):
         yield db
-    finally:
-        db.close()
 
 @app.get("/")
 def hello_world():
   """Hello World Example First FastAPI"""
   return {"Hello": "World"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+  """Prometheus metrics: latency per route and status, SQL statements and time per request, bcrypt and pool checkout wait"""
+  return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles", include_in_schema=False)
+async def get_profiles(request: Request):
+  """Profiles stored by the profiler, newest first; profile a request by sending X-Profile: 1 with the X-Admin-Token header"""
+  error = validate_admin(request)
+  if error is not None:
+    return error
+  return json_response(await run_in_threadpool(list_profiles))
+
+@app.get("/admin/profiles/{profile_id}", include_in_schema=False)
+async def get_profile(profile_id: str, request: Request, format: str = Query("pstats", pattern="^(pstats|text)$")):
+  """Downloads a profile as a pstats file (for snakeviz or pstats), or its top functions as text"""
+  error = validate_admin(request)
+  if error is not None:
+    return error
+  path = profile_path(profile_id)
+  if path is None or not os.path.exists(path):
+    return JSONResponse(status_code=404, content={"error": "Profile not found"})
+  if format == "text":
+    return PlainTextResponse(await run_in_threadpool(profile_text, path))
+  return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/admin/slow-queries", include_in_schema=False)
+def get_slow_queries(request: Request):
+  """Most recent SQL statements slower than SLOW_QUERY_MS, newest first, with their parameter types and query plan"""
+  error = validate_admin(request)
+  if error is not None:
+    return error
+  return json_response(list(reversed(slow_queries)))
+
 @app.post("/signup")
-async def signup(user: UserRequest, db: Session = Depends(get_db)):
+async def signup(user: UserRequest, db: AsyncSession = Depends(get_db)):
   try:
     stmt = select(User).where(User.username == user.username)
-    check_user = db.execute(stmt).scalar_one_or_none()
+    check_user = (await db.execute(stmt)).scalar_one_or_none()
     if check_user:
         return JSONResponse(status_code=400, content={"error": "User already exists"})
     if validate_username(user.username) != True:
         return JSONResponse(status_code=400, content={"error": validate_username(user.username)})
     if validate_password(user.password) != True:
         return JSONResponse(status_code=400, content={"error": validate_password(user.password)})
-    user = insert(User).values(username=user.username, password=get_password_hash(user.password))
-    db.execute(user)
-    db.commit()
+    user = insert(User).values(username=user.username, password=await hash_password(user.password))
+    await db.execute(user)
+    await db.commit()
     return JSONResponse(status_code=201, content={"message": "User created successfully"})
+  except HashPoolFull:
+    return server_busy()
   except Exception as e:
     print(e)
     return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.post("/token")
-async def token(user: UserRequest, db: Session = Depends(get_db)) -> Token:
+async def token(user: UserRequest, db: AsyncSession = Depends(get_db)) -> Token:
   try:
-    check_user = db.execute(select(User).where(User.username == user.username)).scalar_one_or_none()
+    check_user = (await db.execute(select(User).where(User.username == user.username))).scalar_one_or_none()
     if not check_user:
         return JSONResponse(status_code=400, content={"error": "User not found"})
-    if not verify_password(user.password, check_user.password):
+    if not await check_password(user.password, check_user.password):
         return JSONResponse(status_code=400, content={"error": "Incorrect password"})
     access_token = create_access_token(data={"sub": user.username})
     return Token(access_token=access_token, token_type="bearer")
+  except HashPoolFull:
+    return server_busy()
   except Exception as e:
     return JSONResponse(status_code=500, content={"error": str(e)})
   
 @app.post("/tasks")
-async def create_task(task: TaskRequest, request: Request, db: Session = Depends(get_db)) -> TaskResponse:
-  try:
-    validation = validate_request(request, db)
-    if validation.status_code != 200:
-        return validation
-    user_id = json.loads(validation.body)["user_id"]
-    
-    stmt = insert(Task).values(
-        title=task.title,
-        description=task.description,
-        user_id=user_id,
-        status=TaskStatus.pending,
-        created_at=datetime.now()
-    )
-    result = db.execute(stmt)
-    db.commit()
-    task_id = result.inserted_primary_key[0]
-    return TaskResponse(id=task_id, title=task.title, description=task.description, status=TaskStatus.pending.value)
+async def create_task(task: TaskRequest, request: Request, db: AsyncSession = Depends(get_db)) -> TaskResponse:
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    user_id = principal.user_id
+    if task_write_queue is not None:
+        # hand the connection back first, the writer takes one from the same pool
+        await db.close()
+        task_id = await task_write_queue.submit(user_id, task.title, task.description)
+    else:
+        stmt = insert(Task).values(
+            title=task.title,
+            description=task.description,
+            user_id=user_id,
+            status=TaskStatus.pending,
+            created_at=datetime.now()
+        )
+        result = await db.execute(stmt)
+        await update_task_stats(user_id, db, pending=1)
+        await bump_tasks_version(user_id, db)
+        await db.commit()
+        task_id = result.inserted_primary_key[0]
+    created_task = TaskResponse(id=task_id, title=task.title, description=task.description, status=TaskStatus.pending.value).model_dump()
+    broker.publish(user_id, "created", created_task)
+    return json_response(created_task)
   except Exception as e:
     print(e)
     return JSONResponse(status_code=500, content={"error": str(e)})    
 
 @app.get("/tasks")
-async def get_tasks(request: Request, db: Session = Depends(get_db)) -> list[TaskResponse]:
-  try:
-    validation = validate_request(request, db)
-    if validation.status_code != 200:
-        return validation
-    user_id = json.loads(validation.body)["user_id"]
-    stmt = select(Task).where(Task.user_id == user_id)
-    tasks = db.execute(stmt).scalars().all()
-    return [TaskResponse(id=task.id, title=task.title, description=task.description, status=task.status.value) for task in tasks]
+async def get_tasks(
+    request: Request,
+    limit: int = Query(TASKS_PAGE_SIZE, ge=1, le=TASKS_MAX_PAGE_SIZE),
+    cursor: int | None = None,
+    status: TaskStatus | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    db: AsyncSession = Depends(get_read_db),
+) -> list[TaskResponse]:
+  """Returns one page of the user's tasks ordered by id, the next page starts after the X-Next-Cursor header.
+
+  The ETag changes with every task write of the user, a matching If-None-Match is answered
+  with 304 without reading the tasks table.
+  """
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    user_id = principal.user_id
+    version = await get_tasks_version(user_id, db)
+    page_key = repr((limit, cursor, status, created_after, created_before))
+    etag = make_etag(user_id, version, page_key)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    page = get_cached_page(user_id, version, page_key)
+    if page is None:
+        page = await read_tasks_page(user_id, limit, cursor, status, created_after, created_before, db)
+        cache_page(user_id, version, page_key, page)
+    body, next_cursor = page
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return Response(content=body, media_type="application/json", headers=headers)
   except Exception as e:
     print(e)
     return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.get("/tasks/{task_id}")
-async def get_task(task_id: int, request: Request, db: Session = Depends(get_db)) -> TaskResponse:
-  try:
-    task_validation = validate_task(task_id, request, db)
-    if task_validation.status_code != 200:
-        return task_validation
-      
-    task_data = json.loads(task_validation.body)["task"]
-
-    return TaskResponse(
-        id=task_data["id"],
-        title=task_data["title"],
-        description=task_data["description"],
-        status=task_data["status"]
+async def read_tasks_page(user_id: int, limit: int, cursor: int | None, status: TaskStatus | None, created_after: datetime | None, created_before: datetime | None, db: AsyncSession):
+    """Returns the serialized page and the cursor of the next one (None on the last page)."""
+    stmt = select(Task.id, Task.title, Task.description, Task.status).where(Task.user_id == user_id)
+    if cursor is not None:
+        stmt = stmt.where(Task.id > cursor)
+    if status is not None:
+        stmt = stmt.where(Task.status == status)
+    if created_after is not None:
+        stmt = stmt.where(Task.created_at >= created_after)
+    if created_before is not None:
+        stmt = stmt.where(Task.created_at < created_before)
+    # one extra row tells whether there is a next page
+    rows = (await db.execute(stmt.order_by(Task.id).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return dumps(task_rows_to_dicts(rows)), next_cursor
+
+async def export_rows(user_id: int, status: TaskStatus | None, format: str):
+    """Yields the user's tasks as NDJSON lines or CSV, one chunk per fetched batch."""
+    stmt = select(Task.id, Task.title, Task.description, Task.status, Task.created_at).where(Task.user_id == user_id)
+    if status is not None:
+        stmt = stmt.where(Task.status == status)
+    stmt = stmt.order_by(Task.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    if format == "csv":
+        yield "id,title,description,status,created_at\r\n"
+    # the request session is closed once the handler returns, so the stream gets its own
+    async for db in get_session(read_only=True):
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            if format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows((row.id, row.title, row.description, row.status.value, row.created_at.isoformat()) for row in rows)
+                yield buffer.getvalue()
+            else:
+                yield b"".join(
+                    dumps({"id": row.id, "title": row.title, "description": row.description, "status": row.status.value, "created_at": row.created_at.isoformat()}) + b"\n"
+                    for row in rows
+                )
+
+@app.get("/tasks/export")
+async def export_tasks(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: TaskStatus | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+  """Streams every task of the user as newline-delimited JSON or CSV."""
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    if format == "csv":
+        return StreamingResponse(
+            export_rows(principal.user_id, status, format),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="tasks.csv"'},
+        )
+    return StreamingResponse(export_rows(principal.user_id, status, format), media_type="application/x-ndjson")
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/tasks/search")
+async def search(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(TASKS_PAGE_SIZE, ge=1, le=TASKS_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db),
+) -> list[TaskResponse]:
+  """Full-text search over the user's task titles and descriptions, best match first.
+
+  Every word of q must match, a trailing * matches prefixes. The next page starts at the X-Next-Offset header.
+  """
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    if not search_supported(read_engine):
+        return JSONResponse(status_code=501, content={"error": "Search is only available on SQLite"})
+    # one extra row tells whether there is a next page
+    rows = await search_tasks(principal.user_id, q, limit + 1, offset, db)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Offset"] = str(offset + limit)
+    return json_response(task_rows_to_dicts(rows), headers=headers)
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/tasks/archive")
+async def get_archived_tasks(
+    request: Request,
+    limit: int = Query(TASKS_PAGE_SIZE, ge=1, le=TASKS_MAX_PAGE_SIZE),
+    cursor: int | None = None,
+    db: AsyncSession = Depends(get_read_db),
+) -> list[ArchivedTaskResponse]:
+  """Returns one page of the user's archived tasks ordered by id, the next page starts after the X-Next-Cursor header."""
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    stmt = select(TaskArchive.id, TaskArchive.title, TaskArchive.description, TaskArchive.status, TaskArchive.created_at, TaskArchive.archived_at).where(TaskArchive.user_id == principal.user_id)
+    if cursor is not None:
+        stmt = stmt.where(TaskArchive.id > cursor)
+    # one extra row tells whether there is a next page
+    rows = (await db.execute(stmt.order_by(TaskArchive.id).limit(limit + 1))).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = str(rows[-1].id)
+    return json_response([
+        {"id": row.id, "title": row.title, "description": row.description, "status": row.status.value, "created_at": row.created_at.isoformat(), "archived_at": row.archived_at.isoformat()}
+        for row in rows
+    ], headers=headers)
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/tasks/stats")
+async def task_stats(request: Request, db: AsyncSession = Depends(get_read_db)):
+  """Counts of the user's pending and completed tasks, read from the counters maintained by the task writes."""
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    return json_response(await get_task_stats(principal.user_id, db))
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/tasks/stream")
+async def stream_task_events(
+    request: Request,
+    last_event_id: int | None = Query(None, ge=0),
+    last_event_id_header: int | None = Header(None, alias="Last-Event-ID", ge=0),
+    db: AsyncSession = Depends(get_read_db),
+):
+  """Pushes the user's task changes as Server-Sent Events.
+
+  A reconnecting client resumes after the Last-Event-ID header (sent by EventSource) or the
+  last_event_id parameter; a "reset" event means it missed too much and should refetch.
+  """
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    subscriber = broker.subscribe(principal.user_id, last_event_id if last_event_id is not None else last_event_id_header)
+    return StreamingResponse(
+        broker.sse_messages(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
   except Exception as e:
     print(e)
     return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.put("/tasks/{task_id}")
-async def update_task(task_id: int, task: TaskRequest, request: Request, db: Session = Depends(get_db)) -> TaskResponse:
-  try:
-    task_validation = validate_task(task_id, request, db)
-    if task_validation.status_code != 200:
-        return task_validation
-    
-    stmt = select(Task).where(Task.id == task_id)
-    db_task = db.execute(stmt).scalar_one_or_none()
-    
-    if db_task.status == TaskStatus.completed:
-        return JSONResponse(status_code=400, content={"error": "Task is already completed"})
-    
-    db_task.title = task.title
-    db_task.description = task.description
-    db_task.status = TaskStatus.completed
-    db.add(db_task)
-    db.commit()
-    
-    return TaskResponse(
-        id=db_task.id,
-        title=db_task.title,
-        description=db_task.description,
-        status=db_task.status.value
+@app.websocket("/tasks/ws")
+async def task_events_websocket(websocket: WebSocket, last_event_id: int | None = Query(None, ge=0)):
+  """WebSocket equivalent of /tasks/stream, every message is one JSON event."""
+  # no pooled connection is held for the lifetime of the socket
+  async for db in get_session(read_only=True):
+    principal = await validate_request(websocket, db)
+  if isinstance(principal, JSONResponse):
+    return await websocket.close(code=1008)
+  await websocket.accept()
+  subscriber = broker.subscribe(principal.user_id, last_event_id)
+
+  async def send_events():
+    while (event := await subscriber.get()) is not None:
+        await websocket.send_text(event.payload.decode())
+    await websocket.close(code=1013, reason="Too slow, reconnect with last_event_id")
+
+  async def receive_until_disconnect():
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+  tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_until_disconnect())]
+  try:
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+  finally:
+    for task in tasks:
+        task.cancel()
+    broker.unsubscribe(subscriber)
+
+@app.post("/tasks/batch")
+async def create_tasks(tasks: list[TaskRequest], request: Request, db: AsyncSession = Depends(get_db)) -> list[BatchItemResult]:
+  """Creates every task of the batch in one transaction."""
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    if len(tasks) > TASKS_MAX_BATCH_SIZE:
+        return JSONResponse(status_code=400, content={"error": f"Batch size exceeds {TASKS_MAX_BATCH_SIZE}"})
+    if not tasks:
+        return []
+    now = datetime.now()
+    stmt = insert(Task).returning(Task.id, sort_by_parameter_order=True)
+    result = await db.execute(stmt, [
+        {"title": task.title, "description": task.description, "user_id": principal.user_id, "status": TaskStatus.pending, "created_at": now}
+        for task in tasks
+    ])
+    task_ids = result.scalars().all()
+    await update_task_stats(principal.user_id, db, pending=len(task_ids))
+    await bump_tasks_version(principal.user_id, db)
+    await db.commit()
+    results = [
+        BatchItemResult(id=task_id, status_code=201, task=TaskResponse(id=task_id, title=task.title, description=task.description, status=TaskStatus.pending.value)).model_dump()
+        for task_id, task in zip(task_ids, tasks)
+    ]
+    for result in results:
+        broker.publish(principal.user_id, "created", result["task"])
+    return json_response(results)
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.patch("/tasks/batch")
+async def update_tasks(tasks: list[TaskUpdateItem], request: Request, db: AsyncSession = Depends(get_db)) -> list[BatchItemResult]:
+  """Updates and completes the tasks of the batch in one transaction, items that cannot be updated are reported and skipped."""
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    if len(tasks) > TASKS_MAX_BATCH_SIZE:
+        return JSONResponse(status_code=400, content={"error": f"Batch size exceeds {TASKS_MAX_BATCH_SIZE}"})
+    if not tasks:
+        return []
+    # a repeated id sees the task as completed by its first occurrence
+    first = {}
+    for task in tasks:
+        first.setdefault(task.id, task)
+    # the WHERE clause decides which tasks are updated, so a task completed or deleted
+    # concurrently is left alone; RETURNING tells which ones matched
+    stmt = (
+        update(Task)
+        .where(Task.user_id == principal.user_id, Task.id.in_(first), Task.status != TaskStatus.completed)
+        .values(
+            title=case({task_id: task.title for task_id, task in first.items()}, value=Task.id),
+            description=case({task_id: task.description for task_id, task in first.items()}, value=Task.id),
+            status=TaskStatus.completed,
+        )
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
     )
+    updated_ids = set((await db.execute(stmt)).scalars().all())
+    existing_ids = set()
+    if first.keys() - updated_ids:
+        # only the items that matched no row need a lookup to tell 400 from 404
+        stmt = select(Task.id).where(Task.user_id == principal.user_id, Task.id.in_(first.keys() - updated_ids))
+        existing_ids = set((await db.execute(stmt)).scalars().all())
+    results = []
+    for task in tasks:
+        if task.id in updated_ids and first[task.id] is task:
+            results.append(BatchItemResult(id=task.id, status_code=200, task=TaskResponse(id=task.id, title=task.title, description=task.description, status=TaskStatus.completed.value)))
+        elif task.id in updated_ids or task.id in existing_ids:
+            results.append(BatchItemResult(id=task.id, status_code=400, error="Task is already completed"))
+        else:
+            results.append(BatchItemResult(id=task.id, status_code=404, error="Task not found"))
+    if updated_ids:
+        # every row the UPDATE returned went from pending to completed
+        await update_task_stats(principal.user_id, db, pending=-len(updated_ids), completed=len(updated_ids))
+        await bump_tasks_version(principal.user_id, db)
+        await db.commit()
+    results = [result.model_dump() for result in results]
+    for result in results:
+        if result["status_code"] == 200:
+            broker.publish(principal.user_id, "updated", result["task"])
+    return json_response(results)
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.delete("/tasks/batch")
+async def delete_tasks(request: Request, task_ids: list[int] = Body(...), db: AsyncSession = Depends(get_db)) -> list[BatchItemResult]:
+  """Deletes the tasks of the batch in one transaction, ids the user does not own are reported as not found."""
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    if len(task_ids) > TASKS_MAX_BATCH_SIZE:
+        return JSONResponse(status_code=400, content={"error": f"Batch size exceeds {TASKS_MAX_BATCH_SIZE}"})
+    if not task_ids:
+        return []
+    # only the rows actually deleted are reported and counted, whatever happened concurrently
+    stmt = (
+        delete(Task)
+        .where(Task.user_id == principal.user_id, Task.id.in_(set(task_ids)))
+        .returning(Task.id, Task.status)
+        .execution_options(synchronize_session=False)
+    )
+    statuses = dict((await db.execute(stmt)).all())
+    owned_ids = set(statuses)
+    if owned_ids:
+        # counted from the statuses the DELETE returned, like remove_task does for a single task
+        completed = sum(1 for status in statuses.values() if status == TaskStatus.completed)
+        await update_task_stats(principal.user_id, db, pending=completed - len(statuses), completed=-completed)
+        await bump_tasks_version(principal.user_id, db)
+        await db.commit()
+    results = []
+    for task_id in task_ids:
+        if task_id in owned_ids:
+            owned_ids.discard(task_id)
+            broker.publish(principal.user_id, "deleted", {"id": task_id})
+            results.append(BatchItemResult(id=task_id, status_code=200))
+        else:
+            results.append(BatchItemResult(id=task_id, status_code=404, error="Task not found"))
+    return json_response([result.model_dump() for result in results])
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/tasks/{task_id}")
+async def get_task(task_id: int, request: Request, db: AsyncSession = Depends(get_read_db)) -> TaskResponse:
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    version = await get_tasks_version(principal.user_id, db)
+    etag = make_etag(principal.user_id, version, task_id)
+    # the ETag does not say whether the task exists, "*" is only answered once it was found
+    if etag_matches(request, etag, wildcard=False):
+        return not_modified(etag)
+    task = await get_user_task(task_id, principal.user_id, db)
+    if isinstance(task, JSONResponse):
+        return task
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return json_response(task.model_dump(), headers={"ETag": etag})
+  except Exception as e:
+    print(e)
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.put("/tasks/{task_id}")
+async def update_task(task_id: int, task: TaskRequest, request: Request, db: AsyncSession = Depends(get_db)) -> TaskResponse:
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    updated_task = await complete_task(task_id, principal.user_id, task.title, task.description, db)
+    if updated_task is None:
+        return await task_update_error(task_id, principal.user_id, db)
+    await update_task_stats(principal.user_id, db, pending=-1, completed=1)
+    await bump_tasks_version(principal.user_id, db)
+    await db.commit()
+    updated_task = updated_task.model_dump()
+    broker.publish(principal.user_id, "updated", updated_task)
+    return json_response(updated_task)
   except Exception as e:
     print(e)
     return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.delete("/tasks/{task_id}")
-async def delete_task(task_id: int, request: Request, db: Session = Depends(get_db)) -> JSONResponse:
-  try:
-    task_validation = validate_task(task_id, request, db)
-    if task_validation.status_code != 200:
-        return task_validation
-    
-    stmt = select(Task).where(Task.id == task_id)
-    db_task = db.execute(stmt).scalar_one_or_none()
-    
-    db.delete(db_task)
-    db.commit()
+async def delete_task(task_id: int, request: Request, db: AsyncSession = Depends(get_db)) -> JSONResponse:
+  try:
+    principal = await validate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    status = await remove_task(task_id, principal.user_id, db)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": "Task not found"})
+    if status == TaskStatus.completed:
+        await update_task_stats(principal.user_id, db, completed=-1)
+    else:
+        await update_task_stats(principal.user_id, db, pending=-1)
+    await bump_tasks_version(principal.user_id, db)
+    await db.commit()
+    broker.publish(principal.user_id, "deleted", {"id": task_id})
     return JSONResponse(status_code=200, content={"message": "Task deleted successfully"})
   except Exception as e:
     print(e)
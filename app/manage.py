@@ -0,0 +1,73 @@
+"""Maintenance commands, run from the app directory:
+
+    python manage.py init-db
+    python manage.py rebuild-search
+    python manage.py check-stats
+    python manage.py rebuild-stats
+    python manage.py archive-tasks
+    python manage.py vacuum
+"""
+import argparse
+import asyncio
+import sys
+import dotenv
+
+dotenv.load_dotenv()
+
+from db import engine, async_engine, init_db, rebuild_search_index, search_supported, check_task_stats, rebuild_task_stats, vacuum
+from utils.archive_utils import archive_completed_tasks, ARCHIVE_AFTER_DAYS
+
+def rebuild_search():
+    if not search_supported(engine):
+        raise SystemExit("Search is only available on SQLite")
+    init_db()
+    with engine.begin() as connection:
+        rebuild_search_index(connection)
+    print("Search index rebuilt")
+
+def check_stats():
+    with engine.connect() as connection:
+        mismatches = check_task_stats(connection)
+    for mismatch in mismatches:
+        print(f"user {mismatch['user_id']}: counters (pending, completed) = {mismatch['actual']}, tasks table = {mismatch['expected']}")
+    if mismatches:
+        sys.exit(1)
+    print("Task stats are consistent")
+
+def rebuild_stats():
+    with engine.begin() as connection:
+        rebuild_task_stats(connection)
+    print("Task stats rebuilt")
+
+def archive_tasks():
+    async def run():
+        try:
+            return await archive_completed_tasks()
+        finally:
+            await async_engine.dispose()
+    print(f"Archived {asyncio.run(run())} completed tasks older than {ARCHIVE_AFTER_DAYS:g} days")
+
+def vacuum_db():
+    if engine.dialect.name != "sqlite":
+        raise SystemExit("vacuum is only available on SQLite")
+    with engine.connect() as connection:
+        vacuum(connection)
+    print("Database vacuumed")
+
+COMMANDS = {
+    "archive-tasks": archive_tasks,
+    "vacuum": vacuum_db,
+    "check-stats": check_stats,
+    "rebuild-stats": rebuild_stats,
+    "init-db": init_db,
+    "rebuild-search": rebuild_search,
+}
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    COMMANDS[args.command]()
+
+if __name__ == "__main__":
+    main()
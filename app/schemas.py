@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 
 class UserRequest(BaseModel):
@@ -19,4 +20,19 @@ class TaskResponse(BaseModel):
     id: int
     title: str
     description: str
-    status: str
\ No newline at end of file
+    status: str
+
+class ArchivedTaskResponse(TaskResponse):
+    created_at: datetime
+    archived_at: datetime
+
+class TaskUpdateItem(BaseModel):
+    id: int
+    title: str
+    description: str
+
+class BatchItemResult(BaseModel):
+    id: int | None = None
+    status_code: int
+    task: TaskResponse | None = None
+    error: str | None = None
\ No newline at end of file
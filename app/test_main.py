@@ -1,8 +1,46 @@
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+import httpx
+import pytest
 from fastapi.testclient import TestClient
-from main import app
-from schemas import Token
+from fastapi.utils import create_model_field
+from sqlalchemy import create_engine, event, select, insert, update, delete, text
+from sqlalchemy.exc import OperationalError
+from main import app, TASKS_MAX_BATCH_SIZE
+import main
+import manage
+from db import engine, read_engine, async_engine, async_read_engine, init_db, check_task_stats, incremental_vacuum, migrate_tasks_autoincrement, SEARCH_DDL, Task, TaskArchive, TaskStats, TaskStatus
+from schemas import Token, TaskResponse
+from utils import hash_utils, metrics_utils, json_utils, auth_utils, profile_utils, slow_query_utils
+from utils.group_commit_utils import TaskWriteQueue
+from utils.events_utils import TaskEventBroker
+from utils.archive_utils import archive_completed_tasks
+from utils.rate_limit_utils import AdmissionMiddleware, RateLimiter, user_limiter, ip_limiter
+from benchmarks import load_test, serialization
+from utils.auth_utils import principal_cache, invalidate_principal, create_access_token
+from fastapi.responses import PlainTextResponse
+## the lifespan, which creates the schema, only runs when TestClient is used as a context manager
+init_db()
 client = TestClient(app)
 
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    ## every request of the suite comes from the same client, start each test with full buckets
+    user_limiter.clear()
+    ip_limiter.clear()
+
 def test_hello_world():
     response = client.get("/")
     assert response.status_code == 200
@@ -188,4 +226,736 @@ def test_delete_task():
     ## delete task
     response = client.delete("/tasks/1", headers={"Authorization": f"Bearer {token_data['access_token']}", "X-API-Key": "123456"})
     assert response.status_code == 200
-    assert response.json() == {"message": "Task deleted successfully"}
\ No newline at end of file
+    assert response.json() == {"message": "Task deleted successfully"}
+
+def test_concurrent_requests_overlap():
+    ## slow down task reads on the driver side and record how many run at once
+    lock = threading.Lock()
+    in_flight = {"current": 0, "max": 0}
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM tasks" in statement:
+            with lock:
+                in_flight["current"] += 1
+                in_flight["max"] = max(in_flight["max"], in_flight["current"])
+            time.sleep(0.05)
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM tasks" in statement:
+            with lock:
+                in_flight["current"] -= 1
+
+    response = client.post("/token", json={"username": "test2", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as async_client:
+            ## distinct page sizes so that no request is served from the page cache
+            responses = await asyncio.gather(*[async_client.get("/tasks", params={"limit": 10 + i}, headers=headers) for i in range(5)])
+        ## aiosqlite connections are bound to this event loop, release them before it closes
+        await async_read_engine.dispose()
+        return responses
+
+    event.listen(async_read_engine.sync_engine, "before_cursor_execute", before_execute)
+    event.listen(async_read_engine.sync_engine, "after_cursor_execute", after_execute)
+    try:
+        responses = asyncio.run(run())
+    finally:
+        event.remove(async_read_engine.sync_engine, "before_cursor_execute", before_execute)
+        event.remove(async_read_engine.sync_engine, "after_cursor_execute", after_execute)
+    assert all(response.status_code == 200 for response in responses)
+    assert in_flight["max"] > 1
+
+
+def test_hash_pool_full(monkeypatch):
+    ## every slot of the hashing pool and its queue is taken
+    monkeypatch.setattr(hash_utils, "_pending", hash_utils.HASH_POOL_SIZE + hash_utils.HASH_MAX_QUEUE)
+    response = client.post("/token", json={"username": "test", "password": "Test@123"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json() == {"error": "Server busy, try again later"}
+    response = client.post("/signup", json={"username": "test3", "password": "Test@123"})
+    assert response.status_code == 503
+
+
+def test_principal_cache():
+    response = client.post("/token", json={"username": "test2", "password": "Test@123"})
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}", "X-API-Key": "123456"}
+    principal_cache.clear()
+    stats = principal_cache.stats()
+    ## first request misses and caches the principal, the second one hits
+    assert client.get("/tasks", headers=headers).status_code == 200
+    assert principal_cache.stats()["misses"] == stats["misses"] + 1
+    assert client.get("/tasks", headers=headers).status_code == 200
+    assert principal_cache.stats()["hits"] == stats["hits"] + 1
+    principal = principal_cache.get(token)
+    assert principal.username == "test2"
+    ## the api key is still checked on cached tokens
+    response = client.get("/tasks", headers={"Authorization": f"Bearer {token}", "X-API-Key": "invalid_api_key"})
+    assert response.status_code == 401
+    ## invalidating the user drops its tokens
+    invalidate_principal(principal.user_id)
+    assert principal_cache.stats()["size"] == 0
+
+
+def test_get_tasks_pagination():
+    response = client.post("/signup", json={"username": "pager", "password": "Test@123"})
+    assert response.status_code == 201
+    response = client.post("/token", json={"username": "pager", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ids = [client.post("/tasks", json={"title": f"task {i}", "description": "page"}, headers=headers).json()["id"] for i in range(5)]
+    client.put(f"/tasks/{ids[1]}", json={"title": "task 1", "description": "page"}, headers=headers)
+    ## walk the pages with the cursor
+    response = client.get("/tasks", params={"limit": 2}, headers=headers)
+    assert [task["id"] for task in response.json()] == ids[:2]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/tasks", params={"limit": 2, "cursor": cursor}, headers=headers)
+    assert [task["id"] for task in response.json()] == ids[2:4]
+    response = client.get("/tasks", params={"limit": 2, "cursor": response.headers["X-Next-Cursor"]}, headers=headers)
+    assert [task["id"] for task in response.json()] == ids[4:]
+    assert "X-Next-Cursor" not in response.headers
+    ## filters
+    response = client.get("/tasks", params={"status": "completed"}, headers=headers)
+    assert [task["id"] for task in response.json()] == [ids[1]]
+    response = client.get("/tasks", params={"status": "pending", "cursor": ids[1]}, headers=headers)
+    assert [task["id"] for task in response.json()] == ids[2:]
+    response = client.get("/tasks", params={"created_before": "2000-01-01T00:00:00"}, headers=headers)
+    assert response.json() == []
+    response = client.get("/tasks", params={"created_after": "2000-01-01T00:00:00"}, headers=headers)
+    assert len(response.json()) == 5
+    ## invalid parameters
+    assert client.get("/tasks", params={"limit": 0}, headers=headers).status_code == 422
+    assert client.get("/tasks", params={"status": "unknown"}, headers=headers).status_code == 422
+
+
+def test_export_tasks():
+    response = client.post("/token", json={"username": "pager", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ## ndjson export
+    response = client.get("/tasks/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    tasks = [json.loads(line) for line in response.text.splitlines()]
+    assert [task["title"] for task in tasks] == [f"task {i}" for i in range(5)]
+    assert tasks[1]["status"] == "completed"
+    assert set(tasks[0]) == {"id", "title", "description", "status", "created_at"}
+    ## csv export with a status filter
+    response = client.get("/tasks/export", params={"format": "csv", "status": "pending"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "title", "description", "status", "created_at"]
+    assert [row[1] for row in rows[1:]] == ["task 0", "task 2", "task 3", "task 4"]
+    ## invalid format and missing authentication
+    assert client.get("/tasks/export", params={"format": "xml"}, headers=headers).status_code == 422
+    assert client.get("/tasks/export").status_code == 401
+
+
+def test_batch_tasks():
+    response = client.post("/signup", json={"username": "batcher", "password": "Test@123"})
+    assert response.status_code == 201
+    response = client.post("/token", json={"username": "batcher", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ## create
+    response = client.post("/tasks/batch", json=[{"title": f"batch {i}", "description": "batch"} for i in range(3)], headers=headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status_code"] for result in results] == [201, 201, 201]
+    ids = [result["id"] for result in results]
+    assert results[0]["task"] == {"id": ids[0], "title": "batch 0", "description": "batch", "status": "pending"}
+    ## update, task 2 belongs to another user and the last item repeats an id
+    response = client.patch("/tasks/batch", json=[
+        {"id": ids[0], "title": "done 0", "description": "batch"},
+        {"id": 2, "title": "not mine", "description": "batch"},
+        {"id": ids[0], "title": "again", "description": "batch"},
+    ], headers=headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status_code"] for result in results] == [200, 404, 400]
+    assert results[1]["error"] == "Task not found"
+    assert results[2]["error"] == "Task is already completed"
+    response = client.get(f"/tasks/{ids[0]}", headers=headers)
+    assert response.json() == {"id": ids[0], "title": "done 0", "description": "batch", "status": "completed"}
+    ## delete
+    response = client.request("DELETE", "/tasks/batch", json=[ids[1], 2, ids[2]], headers=headers)
+    assert response.status_code == 200
+    assert [result["status_code"] for result in response.json()] == [200, 404, 200]
+    assert [task["id"] for task in client.get("/tasks", headers=headers).json()] == [ids[0]]
+    assert client.get("/tasks/2", headers={"Authorization": headers["Authorization"], "X-API-Key": "123456"}).status_code == 404
+    ## batch size limit and authentication
+    response = client.request("DELETE", "/tasks/batch", json=list(range(TASKS_MAX_BATCH_SIZE + 1)), headers=headers)
+    assert response.status_code == 400
+    assert client.post("/tasks/batch", json=[]).status_code == 401
+
+
+def test_batch_tasks_concurrent_writes():
+    response = client.post("/token", json={"username": "batcher", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ids = [result["id"] for result in client.post("/tasks/batch", json=[{"title": "race", "description": "race"}] * 3, headers=headers).json()]
+    with engine.connect() as connection:
+        user_id = connection.execute(select(Task.user_id).where(Task.id == ids[0])).scalar_one()
+
+    def interleave(prefix, write):
+        ## runs write from another connection right before the batch statement, as a
+        ## concurrent PUT or DELETE committing between a pre-read and the write would
+        fired = []
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            if not fired and statement.startswith(prefix):
+                fired.append(statement)
+                with engine.begin() as connection:
+                    write(connection)
+
+        return before
+
+    def complete_first(connection):
+        connection.execute(update(Task).where(Task.id == ids[0]).values(title="other", status=TaskStatus.completed))
+        connection.execute(update(TaskStats).where(TaskStats.user_id == user_id).values(pending=TaskStats.pending - 1, completed=TaskStats.completed + 1))
+
+    def delete_second(connection):
+        connection.execute(delete(Task).where(Task.id == ids[1]))
+        ## the batch update completed it
+        connection.execute(update(TaskStats).where(TaskStats.user_id == user_id).values(completed=TaskStats.completed - 1))
+
+    for prefix, write, send in [
+        ("UPDATE tasks SET", complete_first, lambda: client.patch("/tasks/batch", json=[{"id": task_id, "title": "mine", "description": "race"} for task_id in ids[:2]], headers=headers)),
+        ("DELETE FROM tasks", delete_second, lambda: client.request("DELETE", "/tasks/batch", json=ids, headers=headers)),
+    ]:
+        before = interleave(prefix, write)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before)
+        event.listen(engine, "before_cursor_execute", before)
+        try:
+            response = send()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before)
+            event.remove(engine, "before_cursor_execute", before)
+        assert response.status_code == 200
+        if write is complete_first:
+            ## the task completed concurrently keeps its title, the other one is updated
+            assert [result["status_code"] for result in response.json()] == [400, 200]
+            assert client.get(f"/tasks/{ids[0]}", headers=headers).json()["title"] == "other"
+            assert client.get(f"/tasks/{ids[1]}", headers=headers).json()["status"] == "completed"
+        else:
+            ## the task deleted concurrently is not found, the others are deleted
+            assert [result["status_code"] for result in response.json()] == [200, 404, 200]
+    assert [task["id"] for task in client.get("/tasks", headers=headers).json() if task["id"] in ids] == []
+    ## the counters only moved for the rows each batch statement changed
+    stats = client.get("/tasks/stats", headers=headers).json()
+    assert stats["total"] == len(client.get("/tasks", headers=headers).json())
+    with engine.connect() as connection:
+        assert check_task_stats(connection) == []
+
+
+def test_task_mutations_use_one_statement():
+    response = client.post("/token", json={"username": "batcher", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    task_id = client.post("/tasks", json={"title": "single", "description": "single"}, headers=headers).json()["id"]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "tasks" in statement:
+            statements.append(statement.split()[0])
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.put(f"/tasks/{task_id}", json={"title": "single done", "description": "single"}, headers=headers)
+        assert response.json() == {"id": task_id, "title": "single done", "description": "single", "status": "completed"}
+        assert statements == ["UPDATE"]
+        ## a failed update looks the task up once to choose the error
+        response = client.put(f"/tasks/{task_id}", json={"title": "single", "description": "single"}, headers=headers)
+        assert response.status_code == 400
+        assert response.json() == {"error": "Task is already completed"}
+        statements.clear()
+        response = client.delete(f"/tasks/{task_id}", headers=headers)
+        assert response.status_code == 200
+        assert statements == ["DELETE"]
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+    assert client.delete(f"/tasks/{task_id}", headers=headers).status_code == 404
+
+
+def test_sqlite_engine_profile():
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    ## the read pool refuses writes
+    with read_engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA query_only").scalar() == 1
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql("DELETE FROM tasks")
+
+
+
+def test_import_time(tmp_path):
+    ## importing the app must not touch the database and must stay within the budget
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'import.db'}")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True,
+    )
+    assert not (tmp_path / "import.db").exists()
+    ## stderr lines look like "import time:  self [us] | cumulative | package"
+    cumulative = {line.split("|")[2].strip(): int(line.split("|")[1]) for line in result.stderr.splitlines() if line.startswith("import time:") and line.count("|") == 2 and "cumulative" not in line}
+    assert cumulative["main"] / 1000 < IMPORT_TIME_BUDGET_MS
+    assert "passlib.context" not in cumulative
+
+
+def test_benchmark_smoke():
+    async def run():
+        async with load_test.in_process_client(app) as bench_client:
+            return await load_test.benchmark(bench_client, users=2, tasks=5, requests=40, concurrency=4)
+
+    report = asyncio.run(run())
+    assert sum(stats["count"] for stats in report["endpoints"].values()) == 40
+    assert all(stats["errors"] == 0 for stats in report["endpoints"].values())
+    ## a run never regresses against itself, a faster baseline is flagged
+    assert load_test.compare(report, report, 0.0) == []
+    faster = {"total_rps": report["total_rps"] * 2, "endpoints": {}}
+    assert len(load_test.compare(report, faster, 0.2)) == 1
+
+
+def test_metrics():
+    response = client.post("/token", json={"username": "test2", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    labels = {"method": "GET", "route": "/tasks/{task_id}"}
+    requests = metrics_utils.REQUESTS.value(**labels, status=200)
+    queries = metrics_utils.REQUEST_QUERIES.sum(**labels)
+    hashes = metrics_utils.PASSWORD_HASH_DURATION.count(operation="verify")
+    principal_cache.clear()
+    ## an uncached principal costs the user lookup, then the tasks version and the task lookups
+    assert client.get("/tasks/2", headers=headers).status_code == 200
+    assert metrics_utils.REQUESTS.value(**labels, status=200) == requests + 1
+    assert metrics_utils.REQUEST_QUERIES.sum(**labels) == queries + 3
+    assert client.post("/token", json={"username": "test2", "password": "Test@123"}).status_code == 200
+    assert metrics_utils.PASSWORD_HASH_DURATION.count(operation="verify") == hashes + 1
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/tasks/{task_id}",status="200"}' in response.text
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert 'db_query_duration_seconds_count{pool="read"}' in response.text
+    assert 'db_pool_checkout_wait_seconds_count{pool="primary"}' in response.text
+    ## the caches report what their stats() counted
+    stats = principal_cache.stats()
+    assert stats["misses"] >= 1
+    lines = response.text.splitlines()
+    assert f'cache_hits_total{{cache="principal"}} {stats["hits"]}' in lines
+    assert f'cache_misses_total{{cache="principal"}} {stats["misses"]}' in lines
+    assert f'cache_entries{{cache="principal"}} {stats["size"]}' in lines
+    assert "# TYPE cache_entries gauge" in lines
+    assert any(line.startswith('cache_hits_total{cache="tasks_page"} ') for line in lines)
+
+
+
+def test_task_etags():
+    response = client.post("/token", json={"username": "batcher", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    response = client.get("/tasks", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    task_id = response.json()[0]["id"]
+    ## an unchanged list is answered with 304 without reading the tasks table
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_read_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/tasks", headers={**headers, "If-None-Match": etag})
+    finally:
+        event.remove(async_read_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not any("FROM tasks" in statement for statement in statements)
+    ## another page has another ETag
+    assert client.get("/tasks", params={"limit": 1}, headers=headers).headers["ETag"] != etag
+    ## single task
+    response = client.get(f"/tasks/{task_id}", headers=headers)
+    task_etag = response.headers["ETag"]
+    assert client.get(f"/tasks/{task_id}", headers={**headers, "If-None-Match": f'W/{task_etag}, "other"'}).status_code == 304
+    ## "*" matches an existing task only, task 2 belongs to another user
+    assert client.get(f"/tasks/{task_id}", headers={**headers, "If-None-Match": "*"}).status_code == 304
+    assert client.get("/tasks/2", headers={**headers, "If-None-Match": "*"}).status_code == 404
+    assert client.get("/tasks/999999", headers={**headers, "If-None-Match": "*"}).status_code == 404
+    ## a write changes both ETags
+    new_task = client.post("/tasks", json={"title": "etag", "description": "etag"}, headers=headers).json()
+    response = client.get("/tasks", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[-1] == new_task
+    assert response.headers["ETag"] != etag
+    assert client.get(f"/tasks/{task_id}", headers={**headers, "If-None-Match": task_etag}).status_code == 200
+    ## a failed write does not
+    etag = response.headers["ETag"]
+    assert client.put(f"/tasks/{task_id}", json={"title": "etag", "description": "etag"}, headers=headers).status_code == 400
+    assert client.get("/tasks", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+
+def test_serialization_paths_agree():
+    rows = serialization.make_rows(50)
+    expected = json.loads(serialization.json_path(rows))
+    assert expected[1] == {"id": 1, "title": "task 1", "description": "description of task 1", "status": "completed"}
+    field = create_model_field(name="Response_get_tasks", type_=list[TaskResponse], mode="serialization")
+    assert json.loads(asyncio.run(serialization.response_model_path(serialization.make_orm_tasks(rows), field))) == expected
+    assert json.loads(json_utils.dumps(json_utils.task_rows_to_dicts(rows))) == expected
+    assert set(serialization.main(["--rows", "100", "--repeat", "1"])) >= {"response model (before)", "row tuples + json"}
+
+
+def test_search_tasks():
+    response = client.post("/signup", json={"username": "searcher", "password": "Test@123"})
+    assert response.status_code == 201
+    response = client.post("/token", json={"username": "searcher", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ids = [result["id"] for result in client.post("/tasks/batch", json=[
+        {"title": "Buy milk", "description": "groceries for the week"},
+        {"title": "Write report", "description": "quarterly groceries budget report"},
+        {"title": "Report bug", "description": "search is slow"},
+    ], headers=headers).json()]
+    ## every word must match, titles weigh like descriptions
+    response = client.get("/tasks/search", params={"q": "groceries"}, headers=headers)
+    assert response.status_code == 200
+    assert sorted(task["id"] for task in response.json()) == ids[:2]
+    response = client.get("/tasks/search", params={"q": "report groceries"}, headers=headers)
+    assert [task["id"] for task in response.json()] == [ids[1]]
+    response = client.get("/tasks/search", params={"q": "repo*"}, headers=headers)
+    assert sorted(task["id"] for task in response.json()) == ids[1:]
+    ## pagination
+    response = client.get("/tasks/search", params={"q": "groceries", "limit": 1}, headers=headers)
+    assert response.headers["X-Next-Offset"] == "1"
+    response = client.get("/tasks/search", params={"q": "groceries", "limit": 1, "offset": 1}, headers=headers)
+    assert len(response.json()) == 1
+    assert "X-Next-Offset" not in response.headers
+    ## operators are searched as text and other users' tasks are never returned
+    assert client.get("/tasks/search", params={"q": 'milk" OR "test'}, headers=headers).json() == []
+    assert client.get("/tasks/search", params={"q": "test"}, headers=headers).json() == []
+    ## updates and deletes keep the index in sync
+    client.put(f"/tasks/{ids[0]}", json={"title": "Buy bread", "description": "bakery"}, headers=headers)
+    assert client.get("/tasks/search", params={"q": "milk"}, headers=headers).json() == []
+    assert [task["id"] for task in client.get("/tasks/search", params={"q": "bread"}, headers=headers).json()] == [ids[0]]
+    client.delete(f"/tasks/{ids[2]}", headers=headers)
+    assert client.get("/tasks/search", params={"q": "bug"}, headers=headers).json() == []
+    assert client.get("/tasks/search", headers=headers).status_code == 422
+    ## the rebuild command re-indexes from the tasks table
+    manage.main(["rebuild-search"])
+    assert [task["id"] for task in client.get("/tasks/search", params={"q": "bread"}, headers=headers).json()] == [ids[0]]
+
+
+def test_task_stats():
+    response = client.post("/signup", json={"username": "counter", "password": "Test@123"})
+    assert response.status_code == 201
+    response = client.post("/token", json={"username": "counter", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    assert client.get("/tasks/stats", headers=headers).json() == {"pending": 0, "completed": 0, "total": 0}
+    ids = [client.post("/tasks", json={"title": "count", "description": "count"}, headers=headers).json()["id"] for _ in range(2)]
+    ids += [result["id"] for result in client.post("/tasks/batch", json=[{"title": "count", "description": "count"}] * 4, headers=headers).json()]
+    client.put(f"/tasks/{ids[0]}", json={"title": "count", "description": "count"}, headers=headers)
+    client.put(f"/tasks/{ids[0]}", json={"title": "count", "description": "count"}, headers=headers)
+    client.patch("/tasks/batch", json=[{"id": ids[1], "title": "count", "description": "count"}, {"id": ids[2], "title": "count", "description": "count"}], headers=headers)
+    assert client.get("/tasks/stats", headers=headers).json() == {"pending": 3, "completed": 3, "total": 6}
+    client.delete(f"/tasks/{ids[0]}", headers=headers)
+    client.delete(f"/tasks/{ids[3]}", headers=headers)
+    client.request("DELETE", "/tasks/batch", json=[ids[1], ids[4]], headers=headers)
+    assert client.get("/tasks/stats", headers=headers).json() == {"pending": 1, "completed": 1, "total": 2}
+    ## the counters match the tasks table for every user, and a rebuild restores drifted ones
+    with engine.begin() as connection:
+        assert check_task_stats(connection) == []
+        connection.execute(update(TaskStats).values(pending=TaskStats.pending + 5))
+        assert check_task_stats(connection) != []
+    manage.main(["rebuild-stats"])
+    with engine.connect() as connection:
+        assert check_task_stats(connection) == []
+    assert client.get("/tasks/stats", headers=headers).json() == {"pending": 1, "completed": 1, "total": 2}
+
+
+def test_group_commit(monkeypatch):
+    monkeypatch.setattr(main, "task_write_queue", TaskWriteQueue(max_batch=8, max_delay=0.05))
+    batches = metrics_utils.GROUP_COMMIT_BATCH_SIZE.count()
+    ## the lifespan starts the writer and commits what is queued on shutdown
+    with TestClient(app) as grouped_client:
+        grouped_client.post("/signup", json={"username": "grouped", "password": "Test@123"})
+        response = grouped_client.post("/token", json={"username": "grouped", "password": "Test@123"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+        results = []
+        def create(number):
+            results.append(grouped_client.post("/tasks", json={"title": f"grouped {number}", "description": "grouped"}, headers=headers))
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith(("PRAGMA synchronous", "INSERT INTO tasks")):
+                statements.append(statement.split(" (")[0])
+
+        threads = [threading.Thread(target=create, args=(number,)) for number in range(20)]
+        event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+            event.remove(engine, "before_cursor_execute", record)
+        assert [response.status_code for response in results] == [200] * 20
+        task_ids = {response.json()["id"] for response in results}
+        assert len(task_ids) == 20
+        ## concurrent inserts share commits, and every acknowledged task is readable
+        assert 3 <= metrics_utils.GROUP_COMMIT_BATCH_SIZE.count() - batches < 20
+        ## each batch is committed with synchronous=FULL, and the connection gets its setting back
+        flushes = metrics_utils.GROUP_COMMIT_BATCH_SIZE.count() - batches
+        ## (the rows of a batch may be inserted by several statements)
+        statements = [statement for statement, _ in itertools.groupby(statements)]
+        assert statements == ["PRAGMA synchronous=FULL", "INSERT INTO tasks", "PRAGMA synchronous=NORMAL"] * flushes
+        for response in results:
+            assert grouped_client.get(f"/tasks/{response.json()['id']}", headers=headers).json() == response.json()
+        assert grouped_client.get("/tasks/stats", headers=headers).json() == {"pending": 20, "completed": 0, "total": 20}
+    assert main.task_write_queue._writer is None
+
+
+def test_task_event_websocket():
+    with TestClient(app) as live_client:
+        live_client.post("/signup", json={"username": "listener", "password": "Test@123"})
+        response = live_client.post("/token", json={"username": "listener", "password": "Test@123"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+        with pytest.raises(Exception):
+            with live_client.websocket_connect("/tasks/ws") as websocket:
+                websocket.receive_json()
+        with live_client.websocket_connect("/tasks/ws", headers=headers) as websocket:
+            task = live_client.post("/tasks", json={"title": "live", "description": "live"}, headers=headers).json()
+            created = websocket.receive_json()
+            assert created["type"] == "created" and created["task"] == task
+            live_client.put(f"/tasks/{task['id']}", json={"title": "live", "description": "done"}, headers=headers)
+            live_client.delete(f"/tasks/{task['id']}", headers=headers)
+            assert [websocket.receive_json()["type"] for _ in range(2)] == ["updated", "deleted"]
+        ## a reconnecting client catches up from the last event it received
+        with live_client.websocket_connect(f"/tasks/ws?last_event_id={created['id']}", headers=headers) as websocket:
+            events = [websocket.receive_json() for _ in range(2)]
+            assert [event["type"] for event in events] == ["updated", "deleted"]
+            assert events[1]["task"] == {"id": task["id"]}
+
+def test_task_event_broker():
+    async def scenario():
+        events = TaskEventBroker(buffer_size=2, history_size=4)
+        subscriber = events.subscribe(1)
+        other = events.subscribe(2)
+        events.publish(1, "created", {"id": 10})
+        events.publish(2, "created", {"id": 20})
+        messages = events.sse_messages(subscriber)
+        assert await messages.__anext__() == b'id: 1\nevent: created\ndata: {"id":1,"type":"created","task":{"id":10}}\n\n'
+        ## resume replays only the user's own missed events
+        assert events.subscribe(1, 0).queue.get_nowait().id == 1
+        assert events.subscribe(1, 1).queue.empty()
+        ## a subscriber that falls behind is dropped instead of buffering without bound
+        dropped = metrics_utils.TASK_EVENT_SUBSCRIBERS_DROPPED.value()
+        events.publish(2, "updated", {"id": 20})
+        events.publish(2, "updated", {"id": 20})
+        assert other.dropped and metrics_utils.TASK_EVENT_SUBSCRIBERS_DROPPED.value() == dropped + 1
+        assert await other.get() is None
+        ## once missed events fell out of the history, or the id is unknown, the client gets a reset
+        events.publish(1, "deleted", {"id": 10})
+        assert events.subscribe(1, 0).queue.get_nowait().type == "reset"
+        resumed = events.subscribe(1, 1)
+        assert resumed.queue.get_nowait().type == "deleted" and resumed.queue.empty()
+        assert events.subscribe(1, 99).queue.get_nowait().type == "reset"
+        await messages.aclose()
+    asyncio.run(scenario())
+
+
+def test_rate_limits(monkeypatch):
+    shed = metrics_utils.REQUESTS_SHED
+    ip_shed, user_shed = shed.value(reason="ip_rate_limit"), shed.value(reason="user_rate_limit")
+    ## bcrypt takes long enough to refill a bucket at the default rate
+    monkeypatch.setattr(ip_limiter, "rate", 0.01)
+    monkeypatch.setattr(ip_limiter, "burst", 2)
+    ip_limiter.clear()
+    assert [client.post("/token", json={"username": "test2", "password": "Test@123"}).status_code for _ in range(2)] == [200, 200]
+    response = client.post("/token", json={"username": "test2", "password": "Test@123"})
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1
+    assert shed.value(reason="ip_rate_limit") == ip_shed + 1
+    ## task endpoints are limited per user, independently of other users
+    monkeypatch.setattr(user_limiter, "rate", 0.01)
+    monkeypatch.setattr(user_limiter, "burst", 3)
+    user_limiter.clear()
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'test2'})}", "X-API-Key": "123456"}
+    other = {"Authorization": f"Bearer {create_access_token({'sub': 'counter'})}", "X-API-Key": "123456"}
+    assert [client.get("/tasks/stats", headers=headers).status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert client.get("/tasks/stats", headers=other).status_code == 200
+    assert shed.value(reason="user_rate_limit") == user_shed + 1
+    ## a bucket refills at its rate
+    limiter = RateLimiter(rate=1000, burst=1)
+    assert limiter.acquire("key") == 0 and limiter.acquire("key") > 0
+    time.sleep(0.01)
+    assert limiter.acquire("key") == 0
+    assert RateLimiter(rate=0, burst=0).acquire("key") == 0
+
+def test_admission_in_flight_cap():
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        if scope["path"] != "/metrics":
+            await release.wait()
+        await PlainTextResponse("done")(scope, receive, send)
+
+    async def run():
+        admission = AdmissionMiddleware(slow_app, max_in_flight=2)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=admission), base_url="http://test") as async_client:
+            admitted = [asyncio.create_task(async_client.get("/tasks")) for _ in range(2)]
+            while admission.in_flight < 2:
+                await asyncio.sleep(0.001)
+            shed = await async_client.get("/tasks")
+            ## exempt paths are never shed
+            assert (await async_client.get("/metrics")).status_code == 200
+            release.set()
+            return shed, await asyncio.gather(*admitted), admission.in_flight
+
+    shed_before = metrics_utils.REQUESTS_SHED.value(reason="in_flight")
+    shed, admitted, in_flight = asyncio.run(run())
+    assert shed.status_code == 503 and shed.headers["Retry-After"] == "1"
+    assert [response.text for response in admitted] == ["done", "done"] and in_flight == 0
+    assert metrics_utils.REQUESTS_SHED.value(reason="in_flight") == shed_before + 1
+
+
+def test_archive_tasks():
+    client.post("/signup", json={"username": "archivist", "password": "Test@123"})
+    response = client.post("/token", json={"username": "archivist", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ids = [result["id"] for result in client.post("/tasks/batch", json=[{"title": "old", "description": "old"}] * 3, headers=headers).json()]
+    client.patch("/tasks/batch", json=[{"id": task_id, "title": "old", "description": "done"} for task_id in ids[:2]], headers=headers)
+    with engine.begin() as connection:
+        connection.execute(update(Task).where(Task.id.in_(ids)).values(created_at=datetime.now() - timedelta(days=60)))
+    etag = client.get("/tasks", headers=headers).headers["ETag"]
+
+    async def run():
+        try:
+            ## batches of one, so the job takes several transactions
+            return await archive_completed_tasks(older_than=timedelta(days=30), batch_size=1)
+        finally:
+            await async_engine.dispose()
+    assert asyncio.run(run()) == 2
+    ## only the pending task is left in the hot table, and the task lists change their ETag
+    response = client.get("/tasks", headers=headers)
+    assert [task["id"] for task in response.json()] == [ids[2]]
+    assert response.headers["ETag"] != etag
+    assert client.get(f"/tasks/{ids[0]}", headers=headers).status_code == 404
+    response = client.get("/tasks/archive", params={"limit": 1}, headers=headers)
+    assert [task["id"] for task in response.json()] == [ids[0]]
+    assert response.json()[0]["status"] == "completed" and response.json()[0]["description"] == "done"
+    response = client.get("/tasks/archive", params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]}, headers=headers)
+    assert [task["id"] for task in response.json()] == [ids[1]] and "X-Next-Cursor" not in response.headers
+    ## archived tasks still count as completed
+    assert client.get("/tasks/stats", headers=headers).json() == {"pending": 1, "completed": 2, "total": 3}
+    with engine.connect() as connection:
+        assert check_task_stats(connection) == []
+        assert connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+        assert incremental_vacuum(connection, 100) >= 0
+    ## nothing else is old enough
+    manage.main(["archive-tasks"])
+    manage.main(["vacuum"])
+    assert client.get("/tasks/archive", headers=headers).status_code == 200
+
+
+def test_archive_highest_task_id():
+    response = client.post("/token", json={"username": "archivist", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+
+    def archive_new_task():
+        task_id = client.post("/tasks", json={"title": "last", "description": "last"}, headers=headers).json()["id"]
+        client.put(f"/tasks/{task_id}", json={"title": "last", "description": "last"}, headers=headers)
+        with engine.begin() as connection:
+            connection.execute(update(Task).where(Task.id == task_id).values(created_at=datetime.now() - timedelta(days=60)))
+
+        async def run():
+            try:
+                return await archive_completed_tasks(older_than=timedelta(days=30))
+            finally:
+                await async_engine.dispose()
+        assert asyncio.run(run()) == 1
+        return task_id
+
+    ## the id of the highest task is not handed out again once it is archived
+    first_id = archive_new_task()
+    second_id = archive_new_task()
+    assert second_id > first_id
+    archived = [task["id"] for task in client.get("/tasks/archive", params={"limit": 100}, headers=headers).json()]
+    assert archived[-2:] == [first_id, second_id]
+
+
+def test_migrate_tasks_autoincrement(tmp_path):
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.begin() as connection:
+        ## the tasks table as created before AUTOINCREMENT, where task 3 reused the id of an archived task
+        connection.exec_driver_sql("CREATE TABLE tasks (id INTEGER NOT NULL, user_id INTEGER, title VARCHAR(100), description VARCHAR(255), status VARCHAR(9), created_at DATETIME, PRIMARY KEY (id))")
+        connection.exec_driver_sql("CREATE INDEX ix_tasks_user_id_id ON tasks (user_id, id)")
+        TaskArchive.__table__.create(connection)
+        for statement in SEARCH_DDL:
+            connection.execute(text(statement))
+        connection.execute(insert(Task), [{"id": task_id, "user_id": 1, "title": "old", "description": "old", "status": TaskStatus.pending, "created_at": datetime.now()} for task_id in (1, 3)])
+        connection.execute(insert(TaskArchive), [{"id": task_id, "user_id": 1, "title": "archived", "description": "archived", "status": TaskStatus.completed, "created_at": datetime.now()} for task_id in (3, 5)])
+    with old_engine.connect() as connection:
+        assert migrate_tasks_autoincrement(connection)
+        assert not migrate_tasks_autoincrement(connection)
+    with old_engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.execute(text(statement))
+        assert connection.execute(select(Task.id).order_by(Task.id)).scalars().all() == [1, 3]
+        assert connection.execute(select(TaskArchive.id).order_by(TaskArchive.id)).scalars().all() == [5, 11]
+        ## new tasks continue after every id in use, and the search triggers are back on tasks
+        new_id = connection.execute(insert(Task).values(user_id=1, title="new", description="new", status=TaskStatus.pending).returning(Task.id)).scalar_one()
+        assert new_id == 12
+        assert connection.exec_driver_sql("SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH 'new'").scalars().all() == [new_id]
+        assert {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'tasks'")} >= {index.name for index in Task.__table__.indexes}
+    old_engine.dispose()
+
+
+def test_request_profiler(monkeypatch, tmp_path):
+    monkeypatch.setattr(profile_utils, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profile_utils, "PROFILE_KEEP", 2)
+    response = client.post("/token", json={"username": "test2", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    ## admin endpoints are hidden until ADMIN_TOKEN is set, and profiling asks for it
+    assert client.get("/admin/profiles").status_code == 404
+    assert "X-Profile-Id" not in client.get("/tasks", headers={**headers, "X-Profile": "1"}).headers
+    monkeypatch.setattr(auth_utils, "ADMIN_TOKEN", "admin-secret")
+    assert client.get("/admin/profiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert "X-Profile-Id" not in client.get("/tasks", headers={**headers, "X-Profile": "1", "X-Admin-Token": "wrong"}).headers
+    admin = {"X-Admin-Token": "admin-secret"}
+    response = client.get("/tasks", params={"limit": 3}, headers={**headers, "X-Profile": "1", **admin})
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    profiles = client.get("/admin/profiles", headers=admin).json()
+    assert profiles[0]["id"] == profile_id and profiles[0]["path"] == "/tasks" and profiles[0]["status"] == 200
+    ## the download is a pstats file covering the handler
+    response = client.get(f"/admin/profiles/{profile_id}", headers=admin)
+    (tmp_path / "download.prof").write_bytes(response.content)
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / "download.prof")).stats}
+    assert "validate_request" in functions
+    assert "Ordered by: cumulative time" in client.get(f"/admin/profiles/{profile_id}", params={"format": "text"}, headers=admin).text
+    assert client.get("/admin/profiles/../../etc", headers=admin).status_code == 404
+    assert client.get("/admin/profiles/0000000000000-00000000", headers=admin).status_code == 404
+    ## sampled requests are profiled without the header, and only the newest PROFILE_KEEP are kept
+    monkeypatch.setattr(profile_utils, "PROFILE_SAMPLE_RATE", 1.0)
+    sampled = [client.get("/").headers["X-Profile-Id"] for _ in range(2)]
+    assert [profile["id"] for profile in client.get("/admin/profiles", headers=admin).json()] == sampled[::-1]
+    assert len(list(tmp_path.glob("*.prof"))) == 3
+
+def test_slow_query_log(monkeypatch, tmp_path):
+    log = tmp_path / "slow.jsonl"
+    monkeypatch.setattr(slow_query_utils, "SLOW_QUERY_MS", 1e-6)
+    monkeypatch.setattr(slow_query_utils, "SLOW_QUERY_LOG", str(log))
+    monkeypatch.setattr(auth_utils, "ADMIN_TOKEN", "admin-secret")
+    response = client.post("/token", json={"username": "test2", "password": "Test@123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", "X-API-Key": "123456"}
+    slow = metrics_utils.SLOW_QUERIES.value(pool="read")
+    ## a page size no other test uses, so the page is read from the database
+    assert client.get("/tasks", params={"limit": 7, "status": "pending"}, headers=headers).status_code == 200
+    monkeypatch.setattr(slow_query_utils, "SLOW_QUERY_MS", 0)
+    assert metrics_utils.SLOW_QUERIES.value(pool="read") > slow
+    records = client.get("/admin/slow-queries", headers={"X-Admin-Token": "admin-secret"}).json()
+    page = next(record for record in records if "FROM tasks" in record["statement"] and "LIMIT" in record["statement"])
+    assert page["pool"] == "read" and page["duration_ms"] > 0
+    ## parameter types are recorded, never the values
+    assert page["parameters"]["rows"] == 1 and "int" in page["parameters"]["types"]
+    assert "pending" not in json.dumps(page["parameters"])
+    assert any("ix_tasks_user_id_status_id" in line for line in page["plan"])
+    assert page in [json.loads(line) for line in log.read_text().splitlines()]
@@ -0,0 +1,74 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from db import engine, get_session, incremental_vacuum, Task, TaskArchive, TaskStatus
+from sqlalchemy import select, insert, delete, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from utils.etag_utils import bump_tasks_version
+from utils.events_utils import broker
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# seconds between two runs of the archiver started with the app, 0 leaves archiving to `manage.py archive-tasks`
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "0"))
+ARCHIVE_VACUUM_PAGES = int(os.getenv("ARCHIVE_VACUUM_PAGES", "2000"))
+
+ARCHIVE_COLUMNS = ["id", "user_id", "title", "description", "status", "created_at", "archived_at"]
+
+async def archive_batch(db: AsyncSession, cutoff: datetime, batch_size: int) -> int:
+    """Moves up to batch_size completed tasks created before cutoff to tasks_archive in one transaction."""
+    stmt = (
+        select(Task.id, Task.user_id)
+        .where(Task.status == TaskStatus.completed, Task.created_at < cutoff)
+        .order_by(Task.created_at)
+        .limit(batch_size)
+    )
+    rows = (await db.execute(stmt)).all()
+    if not rows:
+        return 0
+    task_ids = [row.id for row in rows]
+    moved = select(Task.id, Task.user_id, Task.title, Task.description, Task.status, Task.created_at, literal(datetime.now())).where(Task.id.in_(task_ids))
+    await db.execute(insert(TaskArchive).from_select(ARCHIVE_COLUMNS, moved))
+    await db.execute(delete(Task).where(Task.id.in_(task_ids)))
+    # the counters keep archived tasks as completed, only the task lists change
+    user_ids = sorted({row.user_id for row in rows})
+    for user_id in user_ids:
+        await bump_tasks_version(user_id, db)
+    await db.commit()
+    for row in rows:
+        broker.publish(row.user_id, "archived", {"id": row.id})
+    return len(rows)
+
+def vacuum_free_pages(pages: int = ARCHIVE_VACUUM_PAGES) -> int:
+    with engine.connect() as connection:
+        return incremental_vacuum(connection, pages)
+
+async def archive_completed_tasks(older_than: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS), batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archives every completed task older than older_than, returns how many were moved.
+
+    Each batch is its own short transaction, so requests keep writing in between, and the
+    pages freed in the tasks table and its indexes are then handed back by an incremental vacuum.
+    """
+    cutoff = datetime.now() - older_than
+    total = 0
+    while True:
+        async for db in get_session():
+            moved = await archive_batch(db, cutoff, batch_size)
+        total += moved
+        if moved < batch_size:
+            break
+        # let waiting requests run between batches
+        await asyncio.sleep(0)
+    if total:
+        await run_in_threadpool(vacuum_free_pages)
+    return total
+
+async def run_archiver(interval: float = ARCHIVE_INTERVAL):
+    """Archives every interval seconds until cancelled, started by the lifespan when ARCHIVE_INTERVAL is set."""
+    while True:
+        try:
+            await archive_completed_tasks()
+        except Exception as e:
+            print("Archiver error: ", e)
+        await asyncio.sleep(interval)
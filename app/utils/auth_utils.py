@@ -1,30 +1,47 @@
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta, timezone
 from jwt.exceptions import InvalidTokenError
-from passlib.context import CryptContext
-import dotenv
+from dataclasses import dataclass
+import hmac
 import jwt
 import os
 import re
+import time
 from db import User
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import UserRequest, Token, TaskRequest
 from sqlalchemy import select, insert
+from fastapi import Request
 from fastapi.responses import JSONResponse
-
-dotenv.load_dotenv()
+from utils.cache_utils import TTLCache
+from utils.metrics_utils import REQUESTS_SHED, CACHES
+from utils.rate_limit_utils import user_limiter, too_many_requests
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+# secret of the X-Admin-Token header for the /admin endpoints and on-demand profiling, unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+UPPERCASE_RE = re.compile(r"[A-Z]")
+LOWERCASE_RE = re.compile(r"[a-z]")
+DIGIT_RE = re.compile(r"[0-9]")
+SPECIAL_CHARACTER_RE = re.compile(r"[!@#$%^&*()]")
+ALPHANUMERIC_RE = re.compile(r"[A-Za-z0-9]")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@dataclass(frozen=True, slots=True)
+class Principal:
+    user_id: int
+    username: str
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Authenticated principals keyed by bearer token, tagged with the user id
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE)
+CACHES.register("principal", principal_cache)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def invalidate_principal(user_id: int):
+    """Drops every cached token of a user, call it after deleting the user or changing their password."""
+    principal_cache.invalidate(user_id)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -43,35 +60,64 @@ def validate_token(token: str):
 def validate_password(password: str):
     if len(password) < 8:
         return "Password must be at least 8 characters long"
-    if not re.search(r"[A-Z]", password):
+    if not UPPERCASE_RE.search(password):
         return "Password must contain at least one uppercase letter"
-    if not re.search(r"[a-z]", password):
+    if not LOWERCASE_RE.search(password):
         return "Password must contain at least one lowercase letter"
-    if not re.search(r"[0-9]", password):
+    if not DIGIT_RE.search(password):
         return "Password must contain at least one number"
-    if not re.search(r"[!@#$%^&*()]", password):
+    if not SPECIAL_CHARACTER_RE.search(password):
         return "Password must contain at least one special character"
     return True
 
 def validate_username(username: str):
     if len(username) < 3:
         return "Username must be at least 3 characters long"
-    if not re.search(r"[A-Za-z0-9]", username):
+    if not ALPHANUMERIC_RE.search(username):
         return "Username must contain at least one letter or number"
     return True
 
-def validate_request(request: dict, db: Session):
+async def validate_request(request: dict, db: AsyncSession):
+    """Returns the Principal of the request, or a 401 or 429 JSONResponse."""
+    principal = await authenticate_request(request, db)
+    if isinstance(principal, JSONResponse):
+        return principal
+    wait = user_limiter.acquire(principal.user_id)
+    if wait:
+        REQUESTS_SHED.inc(reason="user_rate_limit")
+        return too_many_requests(wait)
+    return principal
+
+async def authenticate_request(request: dict, db: AsyncSession):
+    """Returns the Principal of the request, or a 401 JSONResponse."""
     authorization = request.headers.get("Authorization")
     api_key = request.headers.get("X-API-Key")
     if authorization is None or api_key is None or authorization.split(" ")[0] != "Bearer":
         return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+    if api_key != "123456":
+        return JSONResponse(status_code=401, content={"error": "Unauthorized"})
     token = authorization.split(" ")[1]
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     payload = validate_token(token)
     if payload is None:
         return JSONResponse(status_code=401, content={"error": "Unauthorized"})
-    if api_key != "123456":
-        return JSONResponse(status_code=401, content={"error": "Unauthorized"})
-    user = db.execute(select(User).where(User.username == payload["sub"])).scalar_one_or_none()
+    user = (await db.execute(select(User.id, User.username).where(User.username == payload["sub"]))).one_or_none()
     if user is None:
         return JSONResponse(status_code=401, content={"error": "Unauthorized"})
-    return JSONResponse(status_code=200, content={"message": "Authorized", "user_id": user.id})
+    principal = Principal(user_id=user.id, username=user.username)
+    principal_cache.set(token, principal, min(payload["exp"], time.time() + PRINCIPAL_CACHE_TTL), tag=user.id)
+    return principal
+
+def is_admin(headers) -> bool:
+    token = headers.get("X-Admin-Token")
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def validate_admin(request: Request):
+    """Returns None for admin requests, a 403 JSONResponse otherwise, or 404 when ADMIN_TOKEN is unset."""
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=404, content={"error": "Not Found"})
+    if not is_admin(request.headers):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    return None
@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire at their own deadline.
+
+    Entries can be tagged (e.g. with a user id) so every entry for a tag can be
+    dropped at once.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, tag = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at: float, tag=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key):
+        _, _, tag = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import time
+from db import TaskVersion
+from fastapi import Request, Response
+from sqlalchemy import select, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils.cache_utils import TTLCache
+from utils.metrics_utils import CACHES
+
+TASKS_PAGE_CACHE_SIZE = int(os.getenv("TASKS_PAGE_CACHE_SIZE", "1024"))
+TASKS_PAGE_CACHE_TTL = int(os.getenv("TASKS_PAGE_CACHE_TTL", "300"))
+
+# Serialized GET /tasks pages keyed by (user_id, version, query string), tagged with the user id;
+# a write bumps the version, so stale pages are never looked up again
+page_cache = TTLCache(TASKS_PAGE_CACHE_SIZE)
+CACHES.register("tasks_page", page_cache)
+
+async def get_tasks_version(user_id: int, db: AsyncSession) -> int:
+    stmt = select(TaskVersion.version).where(TaskVersion.user_id == user_id)
+    return (await db.execute(stmt)).scalar_one_or_none() or 0
+
+async def bump_tasks_version(user_id: int, db: AsyncSession):
+    """Bumps the user's tasks version in the caller's transaction; call it from every task write."""
+    stmt = update(TaskVersion).where(TaskVersion.user_id == user_id).values(version=TaskVersion.version + 1)
+    if (await db.execute(stmt)).rowcount == 0:
+        await db.execute(insert(TaskVersion).values(user_id=user_id, version=1))
+    page_cache.invalidate(user_id)
+
+def make_etag(user_id: int, version: int, *parts) -> str:
+    """Strong ETag of a response derived from the user's tasks version."""
+    digest = hashlib.blake2b(repr((user_id, version) + parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str, wildcard: bool = True) -> bool:
+    """Whether If-None-Match names etag; "*" only matches when wildcard is set, i.e. the resource is known to exist."""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return wildcard
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+def get_cached_page(user_id: int, version: int, query: str):
+    return page_cache.get((user_id, version, query))
+
+def cache_page(user_id: int, version: int, query: str, page):
+    page_cache.set((user_id, version, query), page, time.time() + TASKS_PAGE_CACHE_TTL, tag=user_id)
@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import os
+from collections import deque
+from dataclasses import dataclass
+from utils.json_utils import dumps
+from utils.metrics_utils import TASK_EVENT_SUBSCRIBERS_DROPPED
+
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "256"))
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", "10000"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+
+@dataclass(frozen=True, slots=True)
+class TaskEvent:
+    id: int
+    user_id: int
+    type: str
+    # {"id", "type", "task"} serialized once for every subscriber
+    payload: bytes
+
+class Subscriber:
+    """Bounded event buffer of one stream; the broker drops the subscriber when it overflows."""
+
+    def __init__(self, user_id: int, buffer_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(buffer_size)
+        self.dropped = False
+
+    async def get(self) -> TaskEvent | None:
+        """Returns the next event, or None once the subscriber was dropped for falling behind."""
+        if self.dropped:
+            return None
+        event = await self.queue.get()
+        return None if self.dropped else event
+
+class TaskEventBroker:
+    """In-process pub/sub of task changes with per-user fan-out.
+
+    The last history_size events are kept so a reconnecting stream can resume after the
+    last event id it received. When some of the events it missed are no longer kept, it
+    gets a single "reset" event instead and should refetch the tasks.
+    """
+
+    def __init__(self, buffer_size: int = EVENTS_BUFFER_SIZE, history_size: int = EVENTS_HISTORY_SIZE):
+        self.buffer_size = buffer_size
+        self.last_id = 0
+        self._ids = itertools.count(1)
+        self._history: deque[TaskEvent] = deque(maxlen=history_size)
+        self._subscribers: dict[int, set[Subscriber]] = {}
+
+    def _event(self, user_id: int, type: str, task: dict | None) -> TaskEvent:
+        return TaskEvent(self.last_id, user_id, type, dumps({"id": self.last_id, "type": type, "task": task}))
+
+    def publish(self, user_id: int, type: str, task: dict):
+        """Sends a committed change to the user's streams; call it from every task write."""
+        self.last_id = next(self._ids)
+        event = self._event(user_id, type, task)
+        self._history.append(event)
+        for subscriber in list(self._subscribers.get(user_id, ())):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+                TASK_EVENT_SUBSCRIBERS_DROPPED.inc()
+
+    def subscribe(self, user_id: int, last_event_id: int | None = None) -> Subscriber:
+        """Registers a stream, first queueing the events published after last_event_id."""
+        subscriber = Subscriber(user_id, self.buffer_size)
+        if last_event_id is not None:
+            backlog = self._backlog(user_id, last_event_id)
+            for event in backlog if backlog is not None else [self._event(user_id, "reset", None)]:
+                subscriber.queue.put_nowait(event)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+
+    def _backlog(self, user_id: int, last_event_id: int) -> list[TaskEvent] | None:
+        """Events of the user after last_event_id, or None when some of them are no longer kept."""
+        # an id from the future was handed out before a restart
+        if last_event_id > self.last_id:
+            return None
+        oldest_id = self._history[0].id if self._history else self.last_id + 1
+        if last_event_id < oldest_id - 1:
+            return None
+        events = [event for event in self._history if event.user_id == user_id and event.id > last_event_id]
+        return events if len(events) <= self.buffer_size else None
+
+    async def sse_messages(self, subscriber: Subscriber):
+        """Yields the subscriber's events as Server-Sent Events, with keepalive comments while idle."""
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield b"id: %d\nevent: %s\ndata: %s\n\n" % (event.id, event.type.encode(), event.payload)
+        finally:
+            self.unsubscribe(subscriber)
+
+broker = TaskEventBroker()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime
+from db import engine, Task, TaskStatus, SQLITE_PRAGMAS, get_session
+from sqlalchemy import insert, text
+from utils.etag_utils import bump_tasks_version
+from utils.metrics_utils import GROUP_COMMIT_BATCH_SIZE
+from utils.stats_utils import update_task_stats
+
+# With GROUP_COMMIT=1, POST /tasks hands its insert to a single writer that commits the
+# inserts of concurrent requests together in one transaction
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "5"))
+
+# In WAL mode with synchronous=NORMAL a commit is not fsynced, the WAL is only synced at
+# checkpoints. The writer commits with synchronous=FULL instead, one fsync per batch
+GROUP_COMMIT_FULL_SYNC = engine.dialect.name == "sqlite" and SQLITE_PRAGMAS["synchronous"].upper() in ("NORMAL", "1")
+
+class TaskWriteQueue:
+    """Queues task inserts and commits them in batches from a single writer task.
+
+    A batch is flushed once it holds max_batch rows or max_delay seconds after its first
+    row was queued. Callers are resolved only after the batch is committed, and on SQLite
+    synced to disk; when the transaction fails, every caller of the batch gets the exception.
+    """
+
+    def __init__(self, max_batch: int = GROUP_COMMIT_MAX_BATCH, max_delay: float = GROUP_COMMIT_MAX_DELAY_MS / 1000):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+
+    def start(self):
+        if self._writer is None:
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commits what is already queued and stops the writer."""
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    async def submit(self, user_id: int, title: str, description: str) -> int:
+        """Queues the insert and returns the task id once its batch is committed."""
+        if self._writer is None:
+            raise RuntimeError("TaskWriteQueue is not started")
+        future = asyncio.get_running_loop().create_future()
+        values = {"title": title, "description": description, "user_id": user_id, "status": TaskStatus.pending, "created_at": datetime.now()}
+        await self._queue.put((values, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            stopping = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list):
+        GROUP_COMMIT_BATCH_SIZE.observe(len(batch))
+        try:
+            async for db in get_session():
+                # SQLite refuses to change it inside a transaction, so before the insert begins one
+                if GROUP_COMMIT_FULL_SYNC:
+                    await db.execute(text("PRAGMA synchronous=FULL"))
+                try:
+                    stmt = insert(Task).returning(Task.id, sort_by_parameter_order=True)
+                    task_ids = (await db.execute(stmt, [values for values, _ in batch])).scalars().all()
+                    for user_id, count in sorted(Counter(values["user_id"] for values, _ in batch).items()):
+                        await update_task_stats(user_id, db, pending=count)
+                        await bump_tasks_version(user_id, db)
+                    await db.commit()
+                finally:
+                    # the connection goes back to the pool with the setting of every other one
+                    if GROUP_COMMIT_FULL_SYNC:
+                        await db.rollback()
+                        await db.execute(text(f"PRAGMA synchronous={SQLITE_PRAGMAS['synchronous']}"))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for task_id, (_, future) in zip(task_ids, batch):
+            # a caller that went away is cancelled, its task is still created
+            if not future.done():
+                future.set_result(task_id)
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from utils.metrics_utils import PASSWORD_HASH_DURATION, REQUESTS_SHED
+
+# bcrypt releases the GIL, so a thread pool already spreads hashing across cores;
+# use HASH_POOL_TYPE=process to isolate it from the API workers completely
+HASH_POOL_TYPE = os.getenv("HASH_POOL_TYPE", "thread")
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(os.cpu_count() or 1)))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "64"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """Builds the CryptContext on first use, so importing this module does not load passlib and bcrypt."""
+    from passlib.context import CryptContext
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    # load the bcrypt backend now rather than on the first login
+    pwd_context.handler("bcrypt").get_backend()
+    return pwd_context
+
+class HashPoolFull(Exception):
+    """Raised when more hashing jobs are waiting than HASH_MAX_QUEUE allows."""
+
+_executor: Executor | None = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+def _hash(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+def get_executor() -> Executor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if HASH_POOL_TYPE == "process":
+                _executor = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="bcrypt")
+        return _executor
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+async def run_in_hash_pool(func, *args):
+    """Runs func on the hashing pool; at most HASH_POOL_SIZE jobs run and HASH_MAX_QUEUE wait."""
+    global _pending
+    with _pending_lock:
+        if _pending >= HASH_POOL_SIZE + HASH_MAX_QUEUE:
+            REQUESTS_SHED.inc(reason="hash_pool")
+            raise HashPoolFull()
+        _pending += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+    finally:
+        PASSWORD_HASH_DURATION.observe(time.perf_counter() - started, operation=func.__name__.lstrip("_"))
+        with _pending_lock:
+            _pending -= 1
+
+async def hash_password(password: str) -> str:
+    return await run_in_hash_pool(_hash, password)
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await run_in_hash_pool(_verify, plain_password, hashed_password)
@@ -0,0 +1,27 @@
+import json
+import os
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+except ImportError:
+    orjson = None
+
+# Opt-in: FAST_JSON=1 serializes responses with orjson when it is installed
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1" and orjson is not None
+
+ResponseClass = ORJSONResponse if FAST_JSON else JSONResponse
+
+def dumps(content) -> bytes:
+    if FAST_JSON:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_response(content, status_code: int = 200, headers: dict | None = None):
+    """Renders already validated content; returning a Response stops FastAPI from validating and serializing it again."""
+    return ResponseClass(content=content, status_code=status_code, headers=headers)
+
+def task_rows_to_dicts(rows) -> list[dict]:
+    """Builds the TaskResponse payloads straight from (id, title, description, status) rows."""
+    return [{"id": row.id, "title": row.title, "description": row.description, "status": row.status.value} for row in rows]
@@ -0,0 +1,220 @@
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from utils.slow_query_utils import check_slow_query
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50, 100)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels) -> str:
+    labels = [f'{name}="{escape_label(value)}"' for name, value in labels]
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Counter:
+    """Prometheus counter with a fixed set of label names."""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(zip(self.labels, key))} {value}")
+        return lines
+
+class Histogram:
+    """Prometheus histogram with a fixed set of label names and buckets."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [cumulative count per bucket, count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[1] if entry else 0
+
+    def sum(self, **labels) -> float:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0.0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (buckets, count, total) in sorted(self._values.items()):
+                labels = list(zip(self.labels, key))
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    lines.append(f"{self.name}_bucket{format_labels(labels + [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+class CacheMetrics:
+    """Hits, misses and size of the registered TTLCaches, read from their stats() on every scrape."""
+
+    def __init__(self):
+        self._caches = {}
+
+    def register(self, name: str, cache):
+        self._caches[name] = cache
+
+    def render(self) -> list[str]:
+        stats = {name: cache.stats() for name, cache in sorted(self._caches.items())}
+        lines = []
+        for metric, type, help, field in (
+            ("cache_hits_total", "counter", "Cache lookups answered from the cache", "hits"),
+            ("cache_misses_total", "counter", "Cache lookups that found no live entry", "misses"),
+            ("cache_entries", "gauge", "Entries held by the cache", "size"),
+        ):
+            lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {type}"]
+            lines += [f"{metric}{format_labels([('cache', name)])} {values[field]}" for name, values in stats.items()]
+        return lines
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUESTS_SHED = Counter("http_requests_shed_total", "Requests rejected by admission control and rate limits", ("reason",))
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements executed per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram("http_request_db_seconds", "Time spent in SQL statements per HTTP request", ("method", "route"))
+QUERY_DURATION = Histogram("db_query_duration_seconds", "SQL statement latency", ("pool",))
+SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS", ("pool",))
+POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time waited for a pooled connection", ("pool",))
+PASSWORD_HASH_DURATION = Histogram("password_hash_duration_seconds", "bcrypt job latency, queueing included", ("operation",))
+TASK_EVENT_SUBSCRIBERS_DROPPED = Counter("task_event_subscribers_dropped_total", "Task event streams disconnected for falling behind")
+GROUP_COMMIT_BATCH_SIZE = Histogram("group_commit_batch_size", "Task inserts committed per group commit", (), BATCH_SIZE_BUCKETS)
+CACHES = CacheMetrics()
+
+METRICS = [REQUESTS, REQUESTS_SHED, REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_TIME, QUERY_DURATION, SLOW_QUERIES, POOL_CHECKOUT_WAIT, PASSWORD_HASH_DURATION, GROUP_COMMIT_BATCH_SIZE, TASK_EVENT_SUBSCRIBERS_DROPPED, CACHES]
+
+def render_metrics() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+
+# Stats of the request being handled, shared with the tasks and threads it spawns
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and SQL statements per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": route.path if route is not None else "unmatched"}
+            REQUESTS.inc(**labels, status=status[0])
+            REQUEST_DURATION.observe(elapsed, **labels, status=status[0])
+            REQUEST_QUERIES.observe(stats.queries, **labels)
+            REQUEST_DB_TIME.observe(stats.db_time, **labels)
+
+def pool_name(pool) -> str:
+    return pool.logging_name or "default"
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, pool=pool_name(self))
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, pool=pool_name(self))
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    pool = pool_name(conn.engine.pool)
+    QUERY_DURATION.observe(elapsed, pool=pool)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    if check_slow_query(conn, pool, statement, parameters, executemany, elapsed):
+        SLOW_QUERIES.inc(pool=pool)
+
+def handle_error(context):
+    # after_cursor_execute does not run for failed statements
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+def instrument_engine(sync_engine):
+    """Times every SQL statement of the engine, adds it to the current request's stats and logs the slow ones."""
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(sync_engine, "handle_error", handle_error)
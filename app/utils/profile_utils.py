@@ -0,0 +1,132 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from utils import auth_utils
+
+# fraction of requests profiled without being asked to, e.g. 0.001
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "task-api-profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_TEXT_LINES = int(os.getenv("PROFILE_TEXT_LINES", "60"))
+
+PROFILE_ID_RE = re.compile(r"^[0-9]{13}-[0-9a-f]{8}$")
+# never profiled, like every /admin/ path: event streams only end when the client leaves
+PROFILE_EXEMPT_PATHS = frozenset({"/metrics", "/tasks/stream"})
+
+# cProfile follows a single thread, so one request is profiled at a time
+_profiling = threading.Lock()
+
+def new_profile_id() -> str:
+    # sorts by creation time
+    return f"{time.time_ns() // 1_000_000:013d}-{secrets.token_hex(4)}"
+
+def profile_path(profile_id: str, extension: str = ".prof") -> str | None:
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, profile_id + extension)
+
+def save_profile(profiler: cProfile.Profile, record: dict):
+    """Writes the pstats file and its metadata, then removes the profiles beyond PROFILE_KEEP."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(profile_path(record["id"]))
+    with open(profile_path(record["id"], ".json"), "w") as file:
+        json.dump(record, file)
+    profile_ids = list_profile_ids()
+    for profile_id in profile_ids[:max(0, len(profile_ids) - PROFILE_KEEP)]:
+        for extension in (".prof", ".json"):
+            try:
+                os.remove(profile_path(profile_id, extension))
+            except FileNotFoundError:
+                pass
+
+def list_profile_ids() -> list[str]:
+    """Ids of the stored profiles, oldest first; the directory is shared by every worker."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(name.removesuffix(".json") for name in os.listdir(PROFILE_DIR) if PROFILE_ID_RE.match(name.removesuffix(".json")))
+
+def list_profiles() -> list[dict]:
+    """Metadata of the stored profiles, newest first."""
+    profiles = []
+    for profile_id in reversed(list_profile_ids()):
+        try:
+            with open(profile_path(profile_id, ".json")) as file:
+                profiles.append(json.load(file))
+        except (FileNotFoundError, ValueError):
+            continue
+    return profiles
+
+def profile_text(path: str) -> str:
+    """The functions with the most cumulative time, as printed by pstats."""
+    buffer = io.StringIO()
+    pstats.Stats(path, stream=buffer).sort_stats("cumulative").print_stats(PROFILE_TEXT_LINES)
+    return buffer.getvalue()
+
+def wants_profile(scope) -> bool:
+    headers = Headers(scope=scope)
+    if headers.get("X-Profile") == "1" and auth_utils.is_admin(headers):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+class ProfilerMiddleware:
+    """ASGI middleware running cProfile over the requests asked for by an admin or sampled.
+
+    The response of a profiled request carries an X-Profile-Id header naming the stored
+    profile. Everything else the event loop runs meanwhile ends up in the profile too, and
+    work done in other threads (bcrypt, the sync database mode) shows up as waiting.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] in PROFILE_EXEMPT_PATHS
+            or scope["path"].startswith("/admin/")
+            or not wants_profile(scope)
+            or not _profiling.acquire(blocking=False)
+        ):
+            return await self.app(scope, receive, send)
+        profile_id = new_profile_id()
+        status = [500]
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is attached to this thread
+            _profiling.release()
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            _profiling.release()
+            record = {
+                "id": profile_id,
+                "time": datetime.now().isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status[0],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            await run_in_threadpool(save_profile, profiler, record)
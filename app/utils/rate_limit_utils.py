@@ -0,0 +1,96 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from db import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from fastapi.responses import JSONResponse
+from utils.metrics_utils import REQUESTS_SHED
+
+# a request holds one connection at a time, twice the pool keeps one request queued per
+# connection instead of letting hundreds wait up to DB_POOL_TIMEOUT for one
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW))))
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "20"))
+RATE_LIMIT_USER_BURST = int(os.getenv("RATE_LIMIT_USER_BURST", "100"))
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "5"))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# unauthenticated endpoints limited per client IP, the others are limited per user by validate_request
+IP_LIMITED_PATHS = frozenset({"/signup", "/token"})
+# scrapes must get through under load, and event streams stay open for as long as the client wants
+ADMISSION_EXEMPT_PATHS = frozenset({"/metrics", "/tasks/stream"})
+
+class RateLimiter:
+    """Token bucket per key, refilled at rate tokens per second up to burst; rate 0 disables it.
+
+    Beyond max_keys the least recently used buckets are forgotten, which only refills them.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key) -> float:
+        """Takes a token for key; returns 0 when one was available, else the seconds until the next one."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+user_limiter = RateLimiter(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST)
+ip_limiter = RateLimiter(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+
+def too_many_requests(wait: float) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"error": "Too many requests"}, headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+def server_busy() -> JSONResponse:
+    return JSONResponse(status_code=503, content={"error": "Server busy, try again later"}, headers={"Retry-After": "1"})
+
+class AdmissionMiddleware:
+    """ASGI middleware shedding load before it reaches the database and bcrypt pools.
+
+    Requests beyond max_in_flight are answered 503 right away, and /signup and /token
+    are rate limited per client IP with 429. Both carry a Retry-After header.
+    """
+
+    def __init__(self, app, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+        if scope["path"] in IP_LIMITED_PATHS:
+            client = scope.get("client")
+            wait = ip_limiter.acquire(client[0] if client else None)
+            if wait:
+                REQUESTS_SHED.inc(reason="ip_rate_limit")
+                return await too_many_requests(wait)(scope, receive, send)
+        if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+            REQUESTS_SHED.inc(reason="in_flight")
+            return await server_busy()(scope, receive, send)
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
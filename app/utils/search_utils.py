@@ -0,0 +1,32 @@
+from db import Task
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SEARCH_STMT = text("""
+    SELECT tasks.id, tasks.title, tasks.description, tasks.status
+    FROM tasks_fts JOIN tasks ON tasks.id = tasks_fts.rowid
+    WHERE tasks_fts MATCH :query AND tasks.user_id = :user_id
+    ORDER BY bm25(tasks_fts), tasks.id
+    LIMIT :limit OFFSET :offset
+""").columns(Task.id, Task.title, Task.description, Task.status)
+
+def build_match_query(q: str) -> str | None:
+    """Turns free text into an FTS5 query matching every word, a trailing * keeps prefix matching.
+
+    Each word is quoted, so FTS5 operators and punctuation in q are searched as plain text.
+    """
+    terms = []
+    for word in q.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+async def search_tasks(user_id: int, q: str, limit: int, offset: int, db: AsyncSession):
+    """Returns up to limit of the user's tasks matching q, best bm25 rank first."""
+    query = build_match_query(q)
+    if query is None:
+        return []
+    params = {"query": query, "user_id": user_id, "limit": limit, "offset": offset}
+    return (await db.execute(SEARCH_STMT, params)).all()
@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+# statements slower than this many milliseconds are logged, 0 disables the log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# JSON lines file the slow queries are appended to, they are only kept in memory when unset
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "100"))
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# most recent slow queries, served by GET /admin/slow-queries
+slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+_log_lock = threading.Lock()
+
+def describe_parameters(parameters):
+    """Types of the bound parameters, never their values."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+def explain(conn, statement: str, parameters) -> list[str]:
+    """Plan of the statement, read through a raw DBAPI cursor so it is neither timed nor counted."""
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        # the last column is the plan text, e.g. "SEARCH tasks USING INDEX ..." on SQLite
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+    finally:
+        cursor.close()
+
+def log_slow_query(record: dict):
+    slow_queries.append(record)
+    if SLOW_QUERY_LOG:
+        with _log_lock, open(SLOW_QUERY_LOG, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+def check_slow_query(conn, pool: str, statement: str, parameters, executemany: bool, elapsed: float) -> bool:
+    """Logs the statement with its plan when elapsed exceeds SLOW_QUERY_MS, returns whether it did.
+
+    Called by the statement timing of metrics_utils, which owns the only timing hooks.
+    """
+    if SLOW_QUERY_MS <= 0 or elapsed * 1000 < SLOW_QUERY_MS:
+        return False
+    first = parameters[0] if executemany and parameters else parameters
+    log_slow_query({
+        "time": datetime.now().isoformat(),
+        "pool": pool,
+        "duration_ms": round(elapsed * 1000, 3),
+        "statement": statement,
+        "parameters": {"rows": len(parameters) if executemany else 1, "types": describe_parameters(first)},
+        "plan": explain(conn, statement, first),
+    })
+    return True
@@ -0,0 +1,21 @@
+from db import TaskStats
+from sqlalchemy import select, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+async def update_task_stats(user_id: int, db: AsyncSession, pending: int = 0, completed: int = 0):
+    """Adds the deltas to the user's counters in the caller's transaction; call it from every task write."""
+    if pending == 0 and completed == 0:
+        return
+    stmt = (
+        update(TaskStats)
+        .where(TaskStats.user_id == user_id)
+        .values(pending=TaskStats.pending + pending, completed=TaskStats.completed + completed)
+    )
+    if (await db.execute(stmt)).rowcount == 0:
+        await db.execute(insert(TaskStats).values(user_id=user_id, pending=pending, completed=completed))
+
+async def get_task_stats(user_id: int, db: AsyncSession) -> dict:
+    stmt = select(TaskStats.pending, TaskStats.completed).where(TaskStats.user_id == user_id)
+    row = (await db.execute(stmt)).one_or_none()
+    pending, completed = (row.pending, row.completed) if row is not None else (0, 0)
+    return {"pending": pending, "completed": completed, "total": pending + completed}
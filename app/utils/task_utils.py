@@ -1,24 +1,45 @@
-import json
-from db import Task
+from db import Task, TaskStatus
 from fastapi.responses import JSONResponse
-from fastapi import Request
-from utils.auth_utils import validate_request
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import TaskResponse
 
-def validate_task(task_id: int, request: Request, db: Session):
-    try:
-        validation = validate_request(request, db)
-        if validation.status_code != 200:
-            return validation
-        user_id = json.loads(validation.body)["user_id"]
-        stmt = select(Task).where(Task.user_id == user_id, Task.id == task_id)
-        task = db.execute(stmt).scalar_one_or_none()
-        if task is None:
-            return JSONResponse(status_code=404, content={"error": "Task not found"})
-        task_response = TaskResponse(id=task.id, title=task.title, description=task.description, status=task.status.value)
-        return JSONResponse(status_code=200, content={"task": task_response.model_dump()})
-    except Exception as e:
-        print("Error: ", e)
-        return JSONResponse(status_code=500, content={"error": "Internal Server Error"})
\ No newline at end of file
+async def get_user_task(task_id: int, user_id: int, db: AsyncSession):
+    """Returns the user's task as a TaskResponse, or a 404 JSONResponse."""
+    stmt = select(Task.id, Task.title, Task.description, Task.status).where(Task.user_id == user_id, Task.id == task_id)
+    task = (await db.execute(stmt)).one_or_none()
+    if task is None:
+        return JSONResponse(status_code=404, content={"error": "Task not found"})
+    return TaskResponse(id=task.id, title=task.title, description=task.description, status=task.status.value)
+
+async def complete_task(task_id: int, user_id: int, title: str, description: str, db: AsyncSession):
+    """Updates and completes a pending task of the user with a single UPDATE ... RETURNING.
+
+    Returns the updated TaskResponse, or None when no row matched.
+    """
+    stmt = (
+        update(Task)
+        .where(Task.id == task_id, Task.user_id == user_id, Task.status != TaskStatus.completed)
+        .values(title=title, description=description, status=TaskStatus.completed)
+        .returning(Task.id, Task.title, Task.description, Task.status)
+        .execution_options(synchronize_session=False)
+    )
+    task = (await db.execute(stmt)).one_or_none()
+    if task is None:
+        return None
+    return TaskResponse(id=task.id, title=task.title, description=task.description, status=task.status.value)
+
+async def remove_task(task_id: int, user_id: int, db: AsyncSession) -> TaskStatus | None:
+    """Deletes a task of the user with a single DELETE ... RETURNING.
+
+    Returns the status the task had, or None when no row matched.
+    """
+    stmt = delete(Task).where(Task.id == task_id, Task.user_id == user_id).returning(Task.status).execution_options(synchronize_session=False)
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+async def task_update_error(task_id: int, user_id: int, db: AsyncSession):
+    """Explains why complete_task matched no row; only runs on the failure path."""
+    stmt = select(Task.status).where(Task.id == task_id, Task.user_id == user_id)
+    if (await db.execute(stmt)).scalar_one_or_none() is None:
+        return JSONResponse(status_code=404, content={"error": "Task not found"})
+    return JSONResponse(status_code=400, content={"error": "Task is already completed"})